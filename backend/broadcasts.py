@@ -0,0 +1,179 @@
+import os
+import json
+from datetime import datetime
+from backend.db import conn, transaction, STORAGE_DIR
+from backend.users import flush_user_activity
+
+# 旧版广播历史文件（仅用于一次性迁移）
+BROADCAST_HISTORY_JSON_PATH = os.path.join(STORAGE_DIR, "broadcast_history.json")
+
+# 任务状态
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_CANCELLED = 'cancelled'
+
+# 单个用户的投递状态
+DELIVERY_SENT = 'sent'
+DELIVERY_FAILED = 'failed'
+DELIVERY_BLOCKED = 'blocked'
+DELIVERY_RETRYING = 'retrying'
+
+# 广播任务表：recipient_cursor 之前（含）的用户都已有最终投递结果
+conn.execute("""
+CREATE TABLE IF NOT EXISTS BroadcastJob (
+    job_id TEXT PRIMARY KEY,
+    admin_id INTEGER,
+    kind TEXT,
+    items TEXT,
+    status TEXT,
+    total INTEGER,
+    recipient_cursor INTEGER,
+    success_count INTEGER DEFAULT 0,
+    failed_count INTEGER DEFAULT 0,
+    progress_chat_id INTEGER,
+    progress_message_id INTEGER,
+    created_at TEXT,
+    finished_at TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+""")
+# 旧表补充取消标记：停止请求可能由其他工作进程收到，运行任务的进程定期读取
+if "cancel_requested" not in {row[1] for row in conn.execute("PRAGMA table_info(BroadcastJob)")}:
+    conn.execute("ALTER TABLE BroadcastJob ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_job_status ON BroadcastJob (status)")
+conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_job_created_at ON BroadcastJob (created_at)")
+# 每个用户的投递结果
+conn.execute("""
+CREATE TABLE IF NOT EXISTS BroadcastDelivery (
+    job_id TEXT,
+    user_id INTEGER,
+    status TEXT,
+    error TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (job_id, user_id)
+) WITHOUT ROWID;
+""")
+conn.commit()
+
+_JOB_COLUMNS = ("job_id", "admin_id", "kind", "items", "status", "total", "recipient_cursor", "success_count",
+                "failed_count", "progress_chat_id", "progress_message_id", "created_at", "finished_at", "cancel_requested")
+
+def _job_from_row(row):
+    job = dict(zip(_JOB_COLUMNS, row))
+    job["items"] = json.loads(job["items"]) if job["items"] else []
+    return job
+
+def migrate_broadcast_history_json(path=BROADCAST_HISTORY_JSON_PATH):
+    """将旧的 broadcast_history.json 导入为已完成的任务记录，导入后重命名为 .migrated"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            history = json.load(f)
+        except ValueError:
+            history = []
+    rows = [
+        (f"legacy{i}", h.get("admin_id"), h.get("type", "broadcast"), None, JOB_DONE, h.get("total_users", 0), None,
+         h.get("success_count", 0), h.get("failed_count", 0), None, None, h.get("timestamp"), h.get("timestamp"), 0)
+        for i, h in enumerate(history)
+    ]
+    with transaction():
+        conn.executemany(f"INSERT OR IGNORE INTO BroadcastJob VALUES ({', '.join('?' * len(_JOB_COLUMNS))})", rows)
+    os.replace(path, path + ".migrated")
+    return len(rows)
+
+def create_job(job_id, admin_id, kind, items, progress_chat_id, progress_message_id):
+    """创建广播任务，目标为当前全部可触达用户"""
+    flush_user_activity()
+    created_at = datetime.now().isoformat()
+    total = conn.execute("SELECT COUNT(*) FROM User WHERE is_active = 1").fetchone()[0]
+    with transaction():
+        conn.execute(
+            f"INSERT INTO BroadcastJob VALUES ({', '.join('?' * len(_JOB_COLUMNS))})",
+            (job_id, admin_id, kind, json.dumps(items, ensure_ascii=False), JOB_RUNNING, total, None, 0, 0,
+             progress_chat_id, progress_message_id, created_at, None, 0)
+        )
+    return get_job(job_id)
+
+def get_job(job_id):
+    row = conn.execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM BroadcastJob WHERE job_id = ?", (job_id,)).fetchone()
+    return _job_from_row(row) if row else None
+
+def get_unfinished_jobs():
+    """重启后需要继续的任务"""
+    cursor = conn.execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM BroadcastJob WHERE status = ? ORDER BY created_at", (JOB_RUNNING,))
+    return [_job_from_row(row) for row in cursor]
+
+def get_recent_jobs(limit=10):
+    """最近的任务，按创建时间倒序"""
+    cursor = conn.execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM BroadcastJob ORDER BY created_at DESC LIMIT ?", (limit,))
+    return [_job_from_row(row) for row in cursor]
+
+def get_retrying_user_ids(job_id):
+    """上次标记为 retrying 的用户，需要在本轮重新发送"""
+    return [row[0] for row in conn.execute(
+        "SELECT user_id FROM BroadcastDelivery WHERE job_id = ? AND status = ? ORDER BY user_id", (job_id, DELIVERY_RETRYING)
+    )]
+
+def get_recipient_page(job, after, page_size=1000):
+    """从 after（不含）之后按 user_id 顺序取一页尚无投递记录的可触达用户；after 为 None 时从头开始"""
+    if after is None:
+        after = -(1 << 63)
+    return [row[0] for row in conn.execute(
+        """
+        SELECT u.user_id FROM User u
+        WHERE u.user_id > ? AND u.is_active = 1 AND COALESCE(u.joined_at, '') <= ?
+          AND NOT EXISTS (SELECT 1 FROM BroadcastDelivery d WHERE d.job_id = ? AND d.user_id = u.user_id)
+        ORDER BY u.user_id LIMIT ?
+        """,
+        (after, job["created_at"], job["job_id"], page_size)
+    )]
+
+def record_progress(job_id, recipient_cursor, results, success_count, failed_count):
+    """在一个事务内写入一批投递结果、推进游标，并把无法触达的用户标记为失效"""
+    now = datetime.now().isoformat()
+    with transaction():
+        conn.executemany(
+            "INSERT OR REPLACE INTO BroadcastDelivery VALUES (?, ?, ?, ?, ?)",
+            [(job_id, user_id, status, error, now) for user_id, status, error in results]
+        )
+        conn.execute(
+            "UPDATE BroadcastJob SET recipient_cursor = ?, success_count = ?, failed_count = ? WHERE job_id = ?",
+            (recipient_cursor, success_count, failed_count, job_id)
+        )
+        # 拉黑/注销的用户标记为失效，之后的广播和统计都会跳过
+        conn.executemany(
+            "UPDATE User SET is_active = 0, inactive_reason = ? WHERE user_id = ?",
+            [(error, user_id) for user_id, status, error in results if status == DELIVERY_BLOCKED]
+        )
+
+def finish_job(job_id, status):
+    with transaction():
+        conn.execute("UPDATE BroadcastJob SET status = ?, finished_at = ? WHERE job_id = ?", (status, datetime.now().isoformat(), job_id))
+
+def request_cancel(job_id):
+    """标记运行中的任务需要停止（由运行该任务的进程读取），任务不存在或已结束时返回 False"""
+    with transaction():
+        cursor = conn.execute(
+            "UPDATE BroadcastJob SET cancel_requested = 1 WHERE job_id = ? AND status = ?", (job_id, JOB_RUNNING)
+        )
+    return cursor.rowcount > 0
+
+def is_cancel_requested(job_id):
+    row = conn.execute("SELECT cancel_requested FROM BroadcastJob WHERE job_id = ?", (job_id,)).fetchone()
+    return bool(row and row[0])
+
+def count_retrying(job_id):
+    return conn.execute(
+        "SELECT COUNT(*) FROM BroadcastDelivery WHERE job_id = ? AND status = ?", (job_id, DELIVERY_RETRYING)
+    ).fetchone()[0]
+
+def get_failed_user_ids(job_id, limit=10):
+    """投递失败（含已拉黑）的用户ID"""
+    cursor = conn.execute(
+        "SELECT user_id FROM BroadcastDelivery WHERE job_id = ? AND status != ? ORDER BY updated_at LIMIT ?",
+        (job_id, DELIVERY_SENT, limit)
+    )
+    return [row[0] for row in cursor]
+
+migrate_broadcast_history_json()
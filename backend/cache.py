@@ -0,0 +1,80 @@
+import time
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """有容量上限（条目数，可选近似字节数）的 LRU 缓存，条目可设置过期时间（秒），并统计命中率。
+    可在事件循环和数据库线程之间共享"""
+
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._data = OrderedDict()  # {key: (expires_at, value, size)}
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None, accept=None):
+        """读取条目；accept(value) 为假时视为未命中（计入未命中、返回 default），用于调用方不采用某些缓存值的情况"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value, _ = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    if accept is None or accept(value):
+                        self.hits += 1
+                        return value
+                else:
+                    self.pop(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None, size=0):
+        """写入条目；size 为调用方估算的字节数，仅在设置了 max_bytes 时用于淘汰"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                self.pop(key)
+                return
+            self.pop(key)
+            self._data[key] = (expires_at, value, size)
+            self.current_bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes is not None and self.current_bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self.current_bytes -= entry[2]
+            return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,93 @@
+import os
+import asyncio
+import logging
+from types import MappingProxyType
+from collections import namedtuple
+from backend.db import conn, run_db
+from backend.storage import get_storage, LEGACY_FILES, STORAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+# 检查配置是否被外部修改（配置文件、其他进程写库）的间隔（秒）
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", "5"))
+
+# 未配置管理员时的默认管理员
+DEFAULT_ADMINS = (7389854735,)
+DEFAULT_FORCE_FOLLOW = {"enabled": False, "channel_id": "", "channel_username": ""}
+DEFAULT_INTRO = '这是一个资源管理机器人，支持任意内容合并分享。'
+
+# 配置快照：所有字段不可变，修改配置时整体替换，读取方拿到的快照不会被并发修改
+ConfigSnapshot = namedtuple('ConfigSnapshot', [
+    'admin_ids',        # frozenset[int]
+    'bound_channels',   # tuple[str]
+    'bound_channel',    # str | None
+    'backup_channels',  # tuple[str]
+    'force_follow',     # 只读映射 {enabled, channel_id, channel_username}
+    'intro',            # str
+])
+
+_snapshot = None
+
+def _build_snapshot(storage):
+    env_channel = os.getenv("CHANNEL_ID")
+    bound_channels = storage.get("bind_channels")
+    if bound_channels is None:
+        # 兼容老逻辑，首次用.env
+        bound_channels = [env_channel] if env_channel else []
+    force_follow = dict(DEFAULT_FORCE_FOLLOW)
+    force_follow.update(storage.get("force_follow") or {})
+    return ConfigSnapshot(
+        admin_ids=frozenset(int(i) for i in storage.get("admin_ids", DEFAULT_ADMINS)),
+        bound_channels=tuple(bound_channels),
+        bound_channel=storage.get("bind_channel") or env_channel,
+        backup_channels=tuple(storage.get("backup_channels", [])),
+        force_follow=MappingProxyType(force_follow),
+        intro=storage.get("intro") or DEFAULT_INTRO,
+    )
+
+def reload_config():
+    """从存储重建快照并整体替换"""
+    global _snapshot
+    _snapshot = _build_snapshot(get_storage())
+    return _snapshot
+
+def get_config():
+    """当前配置快照（纯内存读取）"""
+    return _snapshot if _snapshot is not None else reload_config()
+
+def set_config_value(key, value):
+    """修改一项配置：写入存储并立即替换快照"""
+    get_storage().set(key, value)
+    return reload_config()
+
+def _legacy_files_present():
+    return any(os.path.exists(os.path.join(STORAGE_DIR, filename)) for filename, _ in LEGACY_FILES.values())
+
+def _data_version():
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+async def config_watch_loop(interval=CONFIG_RELOAD_INTERVAL, import_files=True):
+    """
+    后台检查外部修改：storage/ 下出现新的配置文件时导入（import_files 为 False 时不检查）；
+    其他进程修改了数据库（PRAGMA data_version 变化）时重新载入存储。两种情况都会替换快照。
+    """
+    loop = asyncio.get_running_loop()
+    version = await run_db(_data_version)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            changed = False
+            if import_files and await loop.run_in_executor(None, _legacy_files_present):
+                imported = await loop.run_in_executor(None, get_storage().import_legacy_files)
+                if imported:
+                    logger.info("检测到配置文件变更，已导入: %s", ', '.join(imported))
+                    changed = True
+            current = await run_db(_data_version)
+            if current != version:
+                version = current
+                await run_db(get_storage().reload)
+                changed = True
+            if changed:
+                reload_config()
+        except Exception as e:
+            logger.error("检查配置变更失败: %s", e)
@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 数据目录（数据库和待导入的配置文件），默认为项目下的 storage/
+STORAGE_DIR = os.path.abspath(os.getenv("STORAGE_DIR") or os.path.join(os.path.dirname(__file__), "..", "storage"))
+DB_PATH = os.path.join(STORAGE_DIR, "mapping.db")
+if not os.path.exists(STORAGE_DIR):
+    os.makedirs(STORAGE_DIR)
+
+# 每个连接缓存的预编译语句数
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+# 只读查询线程数（WAL 模式下读不会被写阻塞）
+DB_READ_THREADS = int(os.getenv("DB_READ_THREADS", "2"))
+# 合并提交：写队列空闲时提交；持续有写入时最多攒这么多次写操作或这么多秒提交一次
+DB_GROUP_COMMIT_MAX_WRITES = int(os.getenv("DB_GROUP_COMMIT_MAX_WRITES", "200"))
+DB_GROUP_COMMIT_MAX_DELAY = float(os.getenv("DB_GROUP_COMMIT_MAX_DELAY", "0.5"))
+
+def _connect():
+    # isolation_level=None：事务由 transaction() 显式管理，不使用 sqlite3 模块的隐式 BEGIN
+    connection = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=DB_CACHED_STATEMENTS)
+    connection.execute("PRAGMA busy_timeout = 5000")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    return connection
+
+# 写连接：建表、迁移在导入时于主线程执行，运行期间所有读写都在数据库线程上执行
+conn = _connect()
+conn.execute("PRAGMA journal_mode = WAL")
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+_readers = ThreadPoolExecutor(max_workers=DB_READ_THREADS, thread_name_prefix="db-reader")
+_reader_local = threading.local()
+_reader_connections = []
+_writer_thread_id = None
+_pending_lock = threading.Lock()
+_pending = 0
+_batch_writes = 0
+_batch_started = 0.0
+_savepoints = 0
+_writer_closed = False
+
+@contextmanager
+def transaction():
+    """
+    写事务。在数据库线程中外层事务保持打开，由队列空闲时统一提交（合并提交），
+    每次调用用 SAVEPOINT 隔离，出错只回滚本次写入；在其他线程（如启动迁移）中立即提交。
+    """
+    global _savepoints, _batch_writes, _batch_started
+    outermost = not conn.in_transaction
+    if outermost:
+        # IMMEDIATE：开始时即取得写锁，多个进程共用数据库时不会因读快照过期而写入失败（SQLITE_BUSY）
+        conn.execute("BEGIN IMMEDIATE")
+        _batch_started = time.monotonic()
+    _savepoints += 1
+    name = f"sp{_savepoints}"
+    conn.execute(f"SAVEPOINT {name}")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+        if outermost and threading.get_ident() != _writer_thread_id:
+            conn.rollback()
+        raise
+    finally:
+        _savepoints -= 1
+    conn.execute(f"RELEASE {name}")
+    _batch_writes += 1
+    if outermost and threading.get_ident() != _writer_thread_id:
+        conn.commit()
+
+def _maybe_commit():
+    """数据库线程每执行完一个操作调用：队列已空或批次过大/过久时提交"""
+    global _batch_writes
+    if not conn.in_transaction:
+        return
+    if _pending == 0 or _batch_writes >= DB_GROUP_COMMIT_MAX_WRITES or time.monotonic() - _batch_started >= DB_GROUP_COMMIT_MAX_DELAY:
+        conn.commit()
+        _batch_writes = 0
+
+def _run_on_writer(func, args, kwargs):
+    global _writer_thread_id, _pending
+    _writer_thread_id = threading.get_ident()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+        try:
+            _maybe_commit()
+        except sqlite3.Error as e:
+            logger.error("数据库提交失败: %s", e)
+            conn.rollback()
+
+async def run_db(func, *args, **kwargs):
+    """在数据库线程上执行 func(*args, **kwargs)；所有读写按提交顺序串行执行，能读到之前尚未提交的写入"""
+    global _pending
+    with _pending_lock:
+        _pending += 1
+    loop = asyncio.get_running_loop()
+    try:
+        future = loop.run_in_executor(_writer, _run_on_writer, func, args, kwargs)
+    except RuntimeError:
+        with _pending_lock:
+            _pending -= 1
+        if not _writer_closed:
+            raise
+        # 停机后数据库线程已关闭，直接在当前线程执行
+        with transaction():
+            return func(*args, **kwargs)
+    return await future
+
+def submit_db(func, *args, **kwargs):
+    """把写操作排入数据库线程后立即返回（不等待结果），与 run_db 共用同一队列、保持顺序；失败只打印日志"""
+    global _pending
+    with _pending_lock:
+        _pending += 1
+    try:
+        future = _writer.submit(_run_on_writer, func, args, kwargs)
+    except RuntimeError:
+        with _pending_lock:
+            _pending -= 1
+        if not _writer_closed:
+            raise
+        with transaction():
+            return func(*args, **kwargs)
+
+    def report(f):
+        if f.exception() is not None:
+            logger.error("数据库写入失败: %s", f.exception())
+    future.add_done_callback(report)
+    return future
+
+def reader_connection():
+    """当前只读线程的连接（每个线程一个）"""
+    connection = getattr(_reader_local, "conn", None)
+    if connection is None:
+        connection = _reader_local.conn = _connect()
+        connection.execute("PRAGMA query_only = 1")
+        _reader_connections.append(connection)
+    return connection
+
+async def run_read(func, *args, **kwargs):
+    """
+    在只读线程池上执行 func(connection, *args, **kwargs)，不排在写操作之后。
+    只能读到已提交的数据，适合 /start 取内容这类热路径查询。
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_readers, lambda: func(reader_connection(), *args, **kwargs))
+
+def has_unflushed_writes():
+    """数据库线程是否有排队中或已执行未提交的写入（只读连接还看不到）"""
+    return _pending > 0 or conn.in_transaction
+
+def db_stats():
+    """数据库线程的排队情况"""
+    return {"pending": _pending, "batch_writes": _batch_writes}
+
+def close_db():
+    """停机时调用：等待已排队的操作完成、提交并关闭连接"""
+    global _writer_closed
+    _writer.shutdown(wait=True)
+    _readers.shutdown(wait=True)
+    _writer_closed = True
+    if conn.in_transaction:
+        conn.commit()
+    for connection in _reader_connections:
+        connection.close()
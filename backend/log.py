@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# 默认日志级别：DEBUG / INFO / WARNING / ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# 按模块设置级别，逗号分隔，如 "bot.handlers=DEBUG,backend.db=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# 输出格式：text（默认，便于阅读）或 json（每行一个 JSON 对象，便于采集）
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# 第三方库默认只输出警告（httpx 每次请求都会打一条 INFO），可用 LOG_LEVELS 覆盖
+DEFAULT_MODULE_LEVELS = {"httpx": "WARNING", "httpcore": "WARNING"}
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"
+
+_listener = None
+
+class JSONFormatter(logging.Formatter):
+    """每条日志一行 JSON：时间、级别、模块、进程、消息，有异常时附带堆栈"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def parse_levels(spec):
+    """解析 "模块=级别,模块=级别" """
+    levels = {}
+    for part in spec.split(","):
+        name, sep, level = part.partition("=")
+        if sep and name.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setup_logging(level=LOG_LEVEL, levels=LOG_LEVELS, fmt=LOG_FORMAT, stream=None):
+    """
+    配置根日志：调用方只把记录放入队列（不做 I/O），由后台线程格式化并写到 stderr，
+    事件循环不会被输出阻塞。重复调用无效果
+    """
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JSONFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    for name, module_level in {**DEFAULT_MODULE_LEVELS, **parse_levels(levels)}.items():
+        logging.getLogger(name).setLevel(module_level)
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """输出队列中剩余的日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# 采样间隔（秒）
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+# 默认慢回调阈值（秒）：事件循环中单次回调/协程步骤超过该时长即记录
+PROFILE_SLOW_CALLBACK = float(os.getenv("PROFILE_SLOW_CALLBACK", "0.1"))
+# 单次分析最长时长（秒）
+PROFILE_MAX_DURATION = float(os.getenv("PROFILE_MAX_DURATION", "300"))
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+_session = None
+
+def _label(key):
+    filename, lineno, name = key
+    if filename.startswith(PROJECT_ROOT + os.sep):
+        filename = os.path.relpath(filename, PROJECT_ROOT)
+    else:
+        filename = os.sep.join(filename.split(os.sep)[-2:])
+    return f"{name} ({filename}:{lineno})"
+
+def _is_idle(key):
+    """事件循环在 selector 中等待 I/O：没有待执行的回调"""
+    return key[2] == "select" and key[0].endswith("selectors.py")
+
+def _describe_handle(handle):
+    """回调的描述：协程步骤显示所属 Task（含协程当前位置），其他回调显示 Handle"""
+    task = getattr(handle._callback, "__self__", None)
+    return repr(task if isinstance(task, asyncio.Task) else handle)
+
+class ProfileSession:
+    """
+    一次分析：后台线程定时读取事件循环线程的调用栈（sys._current_frames）统计热点函数，
+    同时给事件循环的回调计时，记录超过阈值的慢回调（与 asyncio 调试模式的检测相同，
+    但不开启调试模式：调试模式为每个回调记录创建位置，开销大且会扭曲采样结果）。
+    停止后恢复原样，不再有任何开销。
+    """
+
+    def __init__(self, loop, duration, slow_threshold=PROFILE_SLOW_CALLBACK, interval=PROFILE_SAMPLE_INTERVAL):
+        self.loop = loop
+        self.duration = duration
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+        self.samples = 0
+        self.idle_samples = 0
+        self.self_counts = Counter()        # 位于栈顶的次数
+        self.cumulative_counts = Counter()  # 出现在栈中的次数
+        self.slow_callbacks = []            # [(耗时, 描述)]
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = None
+        self._done = asyncio.Event()
+        self._timer = None
+        self._original_run = None
+
+    def start(self):
+        original_run = self._original_run = asyncio.Handle._run
+        threshold = self.slow_threshold
+        slow_callbacks = self.slow_callbacks
+
+        def timed_run(handle):
+            start = time.perf_counter()
+            try:
+                original_run(handle)
+            finally:
+                duration = time.perf_counter() - start
+                if duration >= threshold:
+                    slow_callbacks.append((duration, _describe_handle(handle)))
+        asyncio.Handle._run = timed_run
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        self._timer = self.loop.call_later(self.duration, self.stop)
+
+    def stop(self):
+        """停止采样和计时，恢复原样；可重复调用"""
+        if self._done.is_set():
+            return
+        self._timer.cancel()
+        self._stop.set()
+        self._thread.join()
+        asyncio.Handle._run = self._original_run
+        self._done.set()
+
+    async def wait(self):
+        await self._done.wait()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            top = frame.f_code
+            top_key = (top.co_filename, top.co_firstlineno, top.co_name)
+            if _is_idle(top_key):
+                self.idle_samples += 1
+                continue
+            self.self_counts[top_key] += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if key not in seen:
+                    seen.add(key)
+                    self.cumulative_counts[key] += 1
+                frame = frame.f_back
+
+    def report(self, top=15):
+        """分析结果文本：事件循环繁忙比例、热点函数（按自身/累计采样数）、最慢的回调"""
+        busy = self.samples - self.idle_samples
+        lines = [
+            f"🔬 性能分析结果（{self.duration:g} 秒，每 {self.interval * 1000:g} ms 采样）",
+            f"采样 {self.samples} 次，事件循环繁忙 {busy} 次（{busy / self.samples * 100 if self.samples else 0:.1f}%）",
+        ]
+        if busy:
+            lines.append("\n【热点函数（自身）】")
+            for key, count in self.self_counts.most_common(top):
+                lines.append(f"{count / busy * 100:5.1f}%  {_label(key)}")
+            # 累计排名只列项目代码（bot/、backend/），事件循环和库函数几乎总在栈中
+            own = [(key, count) for key, count in self.cumulative_counts.most_common() if key[0].startswith(PROJECT_ROOT + os.sep) and key[0] != __file__]
+            lines.append("\n【项目函数（累计）】")
+            for key, count in own[:top]:
+                lines.append(f"{count / busy * 100:5.1f}%  {_label(key)}")
+        slow = sorted(self.slow_callbacks, reverse=True)
+        lines.append(f"\n【慢回调（超过 {self.slow_threshold * 1000:g} ms）】共 {len(slow)} 次")
+        for duration, description in slow[:10]:
+            lines.append(f"{duration * 1000:.0f} ms  {description[:200]}")
+        return "\n".join(lines)
+
+def get_active_session():
+    return _session
+
+def start_profiling(duration, slow_threshold=PROFILE_SLOW_CALLBACK):
+    """在当前事件循环上开始分析（同一时间只能有一个），duration 秒后自动停止"""
+    global _session
+    if _session is not None:
+        raise RuntimeError("已有分析在进行中")
+    session = ProfileSession(asyncio.get_running_loop(), min(duration, PROFILE_MAX_DURATION), slow_threshold)
+    session.start()
+    _session = session
+    logger.info("开始性能分析 %s 秒，慢回调阈值 %s 秒", session.duration, slow_threshold)
+    return session
+
+async def collect_report(session):
+    """等待分析结束（到时或 stop_profiling），返回结果文本"""
+    global _session
+    try:
+        await session.wait()
+    finally:
+        session.stop()
+        if _session is session:
+            _session = None
+    return session.report()
+
+def stop_profiling():
+    """提前结束正在进行的分析，没有时返回 False"""
+    if _session is None:
+        return False
+    _session.stop()
+    return True
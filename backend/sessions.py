@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+from backend.db import conn, transaction, submit_db, run_db
+
+logger = logging.getLogger(__name__)
+
+# 清理过期会话状态的间隔（秒）
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+# 会话状态表：审核队列、管理员输入状态、用户草稿等，按 namespace 区分，值为 JSON
+with transaction():
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS SessionState (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        expires_at REAL,
+        PRIMARY KEY (namespace, key)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_session_state_expires_at ON SessionState (expires_at)")
+
+_MISSING = object()
+_stores = []
+
+class StateStore:
+    """
+    持久化的 {key: value}，用法与 dict 相近。启动时只载入未过期条目的 JSON 文本，
+    首次访问某个键时才解码（懒加载）；写入先更新内存再排入数据库线程。
+    条目在最后一次写入 ttl 秒后过期，由 sweep() 定期清理。对取出的值做原地修改后需调用 save(key) 才会持久化。
+    设置 max_bytes 时按 JSON 长度估算占用，超出后从最久未写入的条目开始淘汰。
+    多个进程共用数据库时，owns(key) 为真的键才载入本进程（如按用户分片的状态只载入分发到本进程的用户）；
+    过期清理和淘汰只删除数据库中仍是本进程所见版本（expires_at 相同）的行，不会删掉其他进程刚写入或续期的条目。
+    """
+
+    def __init__(self, namespace, ttl=None, key_type=str, max_bytes=None, owns=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.key_type = key_type
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # {key: [value 或 _MISSING, JSON 文本或 None, expires_at, 字节数]}，按最后写入时间排序
+        self._entries = OrderedDict()
+        now = time.time()
+        rows = conn.execute(
+            "SELECT key, value, expires_at FROM SessionState WHERE namespace = ? ORDER BY expires_at", (namespace,)
+        ).fetchall()
+        for key, raw, expires_at in rows:
+            key = key_type(key)
+            if (expires_at is None or expires_at > now) and (owns is None or owns(key)):
+                self._entries[key] = [_MISSING, raw, expires_at, len(raw)]
+                self.current_bytes += len(raw)
+        if any(expires_at is not None and expires_at <= now for _, _, expires_at in rows):
+            with transaction():
+                conn.execute("DELETE FROM SessionState WHERE namespace = ? AND expires_at <= ?", (namespace, now))
+        _stores.append(self)
+
+    def _entry(self, key):
+        """取未过期的条目并在需要时解码；过期条目直接丢弃"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] is not None and entry[2] <= time.time():
+            self._drop(key)
+            return None
+        if entry[0] is _MISSING:
+            entry[0] = json.loads(entry[1])
+            entry[1] = None
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entry(key)
+        return default if entry is None else entry[0]
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._entry(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._entry(key) is not None
+
+    def __setitem__(self, key, value):
+        self._store(key, value, self._write_row)
+
+    def save(self, key):
+        """
+        原地修改取出的值之后调用，重新写入并刷新过期时间。
+        只更新数据库中仍存在的条目：期间被其他进程 claim 掉的条目不会被写回
+        """
+        with self._lock:
+            entry = self._entry(key)
+        if entry is not None:
+            self._store(key, entry[0], self._update_row)
+
+    def _store(self, key, value, write):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        raw = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[3]
+            self._entries[key] = [value, None, expires_at, len(raw)]
+            self.current_bytes += len(raw)
+            self._evict(keep=key)
+        submit_db(write, str(key), raw, expires_at)
+
+    async def refresh(self, key):
+        """
+        从数据库重新读取一个键，用于多个进程共用的状态（如审核队列）：
+        其他进程写入或删除的条目在本进程内存中不会自动更新，读取前先调用此方法
+        """
+        row = await run_db(self._read_row, str(key))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[3]
+            if row is not None and (row[1] is None or row[1] > time.time()):
+                self._entries[key] = [_MISSING, row[0], row[1], len(row[0])]
+                self.current_bytes += len(row[0])
+
+    async def claim(self, key, default=None):
+        """原子地取出并删除一个键：多个进程同时调用时只有一个能取到"""
+        row = await run_db(self._claim_row, str(key))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[3]
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return json.loads(row[0])
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return default
+            self._drop(key, only_if_unchanged=False)
+        return entry[0]
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        return list(self._entries)
+
+    def sweep(self):
+        """清理已过期的条目，返回清理数量"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry[2] is not None and entry[2] <= now]
+            for key in expired:
+                self._drop(key)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+    def _evict(self, keep):
+        """超出 max_bytes 时淘汰最久未写入的条目（不淘汰刚写入的 keep）"""
+        if self.max_bytes is None:
+            return
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._drop(key)
+            self.evictions += 1
+
+    def _drop(self, key, only_if_unchanged=True):
+        """
+        移除条目并删除数据库中的行。过期和淘汰时 only_if_unchanged 为真：
+        只删除 expires_at 仍与内存中相同的行，期间被其他进程重新写入（续期）的条目保留
+        """
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry[3]
+        if only_if_unchanged:
+            submit_db(self._delete_row_if_unchanged, str(key), entry[2])
+        else:
+            submit_db(self._delete_row, str(key))
+
+    def _write_row(self, key, raw, expires_at):
+        with transaction():
+            conn.execute(
+                "INSERT OR REPLACE INTO SessionState (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, raw, expires_at)
+            )
+
+    def _update_row(self, key, raw, expires_at):
+        with transaction():
+            conn.execute(
+                "UPDATE SessionState SET value = ?, expires_at = ? WHERE namespace = ? AND key = ?",
+                (raw, expires_at, self.namespace, key)
+            )
+
+    def _read_row(self, key):
+        return conn.execute(
+            "SELECT value, expires_at FROM SessionState WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ).fetchone()
+
+    def _claim_row(self, key):
+        with transaction():
+            return conn.execute(
+                "DELETE FROM SessionState WHERE namespace = ? AND key = ? RETURNING value, expires_at", (self.namespace, key)
+            ).fetchone()
+
+    def _delete_row(self, key):
+        with transaction():
+            conn.execute("DELETE FROM SessionState WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def _delete_row_if_unchanged(self, key, expires_at):
+        with transaction():
+            conn.execute(
+                "DELETE FROM SessionState WHERE namespace = ? AND key = ? AND expires_at IS ?", (self.namespace, key, expires_at)
+            )
+
+def _purge_expired_rows(now):
+    with transaction():
+        conn.execute("DELETE FROM SessionState WHERE expires_at <= ?", (now,))
+
+async def session_sweep_loop(interval=SESSION_SWEEP_INTERVAL):
+    """后台定期清理所有 StateStore 中过期的条目，并删除数据库中残留的过期行"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            swept = sum(store.sweep() for store in _stores)
+            submit_db(_purge_expired_rows, time.time())
+            if swept:
+                logger.debug("已清理过期会话状态 %s 条", swept)
+        except Exception as e:
+            logger.error("清理会话状态失败: %s", e)
@@ -0,0 +1,152 @@
+import os
+import copy
+import json
+import threading
+import logging
+from backend.db import conn, transaction, submit_db, STORAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+# 配置文件 -> 存储键：启动时若 storage/ 下存在这些文件（旧版数据或手动编辑的配置），
+# 导入后覆盖存储中的值，并重命名为 .migrated
+# users.json、broadcast_history.json、follow_stats.json 已分别迁移到 User / BroadcastJob / FollowRecord 表
+LEGACY_FILES = {
+    "admin_ids": ("admin_ids.json", "json"),
+    "bind_channels": ("bind_channels.json", "json"),
+    "bind_channel": ("bind_channel.txt", "text"),
+    "backup_channels": ("backup_channels.json", "json"),
+    "force_follow": ("force_follow.json", "json"),
+    "intro": ("intro.txt", "text"),
+}
+
+class Storage:
+    """键值存储接口：值为可 JSON 序列化的对象。读取全部走内存，返回副本，调用方修改后需调用 set 保存"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return copy.deepcopy(default)
+            return copy.deepcopy(self._data[key])
+
+    def set(self, key, value):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._data[key] = value
+        return self._write(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is None:
+                return None
+        return self._write(key, None)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def reload(self):
+        """重新从持久化介质载入（其他进程修改后调用），由子类实现"""
+
+    def _write(self, key, value):
+        """持久化一次修改，value 为 None 表示删除；返回可等待写入完成的 Future，由子类实现"""
+        return None
+
+    def import_legacy_files(self, directory=STORAGE_DIR):
+        """导入 storage/ 下的配置文件，文件内容覆盖存储中的同名键"""
+        imported = []
+        written = []
+        for key, (filename, kind) in LEGACY_FILES.items():
+            path = os.path.join(directory, filename)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                if kind == "json":
+                    try:
+                        value = json.load(f)
+                    except ValueError:
+                        logger.warning("配置文件 %s 无法解析，跳过", filename)
+                        continue
+                else:
+                    value = f.read().strip()
+            written.append((path, self.set(key, value)))
+            imported.append(key)
+        # 确认已写入数据库后再重命名旧文件
+        for path, future in written:
+            if future is not None:
+                future.result()
+            os.replace(path, path + ".migrated")
+        return imported
+
+class SQLiteStorage(Storage):
+    """mapping.db 中 KeyValue 表的实现：启动时整表载入内存，修改同步更新内存并排入数据库线程写入"""
+
+    def __init__(self, connection=conn):
+        super().__init__()
+        self._conn = connection
+        self._unsaved = {}  # {key: 已排队未写入的修改数}，重新载入时保留这些键的内存值
+        with transaction():
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS KeyValue (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID
+            """)
+        self.reload()
+
+    def reload(self):
+        rows = self._conn.execute("SELECT key, value FROM KeyValue").fetchall()
+        data = {key: json.loads(value) for key, value in rows}
+        with self._lock:
+            for key in self._unsaved:
+                if key in self._data:
+                    data[key] = self._data[key]
+                else:
+                    data.pop(key, None)
+            self._data = data
+
+    def _write(self, key, value):
+        with self._lock:
+            self._unsaved[key] = self._unsaved.get(key, 0) + 1
+        if value is None:
+            return submit_db(self._delete_row, key)
+        return submit_db(self._write_row, key, json.dumps(value, ensure_ascii=False))
+
+    def _saved(self, key):
+        with self._lock:
+            self._unsaved[key] -= 1
+            if not self._unsaved[key]:
+                del self._unsaved[key]
+
+    def _write_row(self, key, encoded):
+        try:
+            with transaction():
+                self._conn.execute(
+                    "INSERT INTO KeyValue (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP",
+                    (key, encoded)
+                )
+        finally:
+            self._saved(key)
+
+    def _delete_row(self, key):
+        try:
+            with transaction():
+                self._conn.execute("DELETE FROM KeyValue WHERE key = ?", (key,))
+        finally:
+            self._saved(key)
+
+_storage = None
+
+def get_storage():
+    """当前使用的存储；首次调用时创建 SQLiteStorage 并导入配置文件（应在启动时、事件循环外调用）"""
+    global _storage
+    if _storage is None:
+        _storage = SQLiteStorage()
+        imported = _storage.import_legacy_files()
+        if imported:
+            logger.info("已导入配置文件: %s", ', '.join(imported))
+    return _storage
@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import logging
+from datetime import datetime, timedelta
+from backend.db import conn, transaction, run_db, STORAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+# 旧版用户列表文件（仅用于一次性迁移）
+USERS_JSON_PATH = os.path.join(STORAGE_DIR, "users.json")
+# 旧版关注统计文件（仅用于一次性迁移）
+FOLLOW_STATS_JSON_PATH = os.path.join(STORAGE_DIR, "follow_stats.json")
+
+# 初始化用户表，user_id 为主键，按主键 upsert 单行
+conn.execute("""
+CREATE TABLE IF NOT EXISTS User (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    joined_at TEXT,
+    last_active TEXT,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    inactive_reason TEXT
+);
+""")
+# 旧表补充可达状态字段：拉黑/注销/不存在的用户 is_active = 0
+_user_columns = {row[1] for row in conn.execute("PRAGMA table_info(User)")}
+if "is_active" not in _user_columns:
+    conn.execute("ALTER TABLE User ADD COLUMN is_active INTEGER NOT NULL DEFAULT 1")
+if "inactive_reason" not in _user_columns:
+    conn.execute("ALTER TABLE User ADD COLUMN inactive_reason TEXT")
+conn.execute("CREATE INDEX IF NOT EXISTS idx_user_joined_at ON User (joined_at)")
+# 通过强制关注检查的用户，每个用户一行
+conn.execute("""
+CREATE TABLE IF NOT EXISTS FollowRecord (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    followed_at TEXT NOT NULL
+);
+""")
+conn.execute("CREATE INDEX IF NOT EXISTS idx_follow_record_followed_at ON FollowRecord (followed_at)")
+conn.commit()
+
+def migrate_users_json(path=USERS_JSON_PATH):
+    """将旧的 users.json 一次性导入 User 表，导入后重命名为 users.json.migrated"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            users = json.load(f)
+        except ValueError:
+            users = []
+    rows = [
+        (u["user_id"], u.get("username"), u.get("first_name"), u.get("last_name"), u.get("joined_at"), u.get("last_active"))
+        for u in users if u.get("user_id") is not None
+    ]
+    with transaction():
+        conn.executemany(
+            "INSERT OR IGNORE INTO User (user_id, username, first_name, last_name, joined_at, last_active) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+    os.replace(path, path + ".migrated")
+    return len(rows)
+
+def _import_follow_records(records):
+    rows = [
+        (r["user_id"], r.get("username"), r.get("timestamp") or datetime.now().isoformat())
+        for r in records if isinstance(r, dict) and r.get("user_id") is not None
+    ]
+    conn.executemany("INSERT OR IGNORE INTO FollowRecord (user_id, username, followed_at) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+def migrate_follow_stats(path=FOLLOW_STATS_JSON_PATH):
+    """
+    将旧的关注统计（KeyValue 中的 follow_stats 及 follow_stats.json）一次性导入 FollowRecord 表，
+    导入后删除该键、文件重命名为 follow_stats.json.migrated
+    """
+    count = 0
+    has_key_value = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'KeyValue'").fetchone()
+    row = conn.execute("SELECT value FROM KeyValue WHERE key = 'follow_stats'").fetchone() if has_key_value else None
+    if row is not None:
+        try:
+            records = json.loads(row[0]).get("follow_records", [])
+        except (ValueError, AttributeError):
+            records = []
+        with transaction():
+            count += _import_follow_records(records)
+            conn.execute("DELETE FROM KeyValue WHERE key = 'follow_stats'")
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            try:
+                records = json.load(f).get("follow_records", [])
+            except (ValueError, AttributeError):
+                records = []
+        with transaction():
+            count += _import_follow_records(records)
+        os.replace(path, path + ".migrated")
+    return count
+
+def record_follow(user_id, username=None):
+    """记录用户通过强制关注检查，首次记录时返回 True"""
+    with transaction():
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO FollowRecord (user_id, username, followed_at) VALUES (?, ?, ?)",
+            (user_id, username, datetime.now().isoformat())
+        )
+    return cursor.rowcount > 0
+
+def get_follow_stats():
+    """关注统计：总人数、今日新增、最近一次关注的时间"""
+    start = datetime.now().date().isoformat()
+    total, last = conn.execute("SELECT COUNT(*), MAX(followed_at) FROM FollowRecord").fetchone()
+    today = conn.execute("SELECT COUNT(*) FROM FollowRecord WHERE followed_at >= ?", (start,)).fetchone()[0]
+    return {"total_follows": total, "today_follows": today, "last_follow_at": last}
+
+def reset_follow_stats():
+    """清空关注记录"""
+    with transaction():
+        conn.execute("DELETE FROM FollowRecord")
+
+# 活跃度写回缓冲：每个用户只保留最近一次的信息，定时批量落盘
+_pending_profiles = {}  # {user_id: (username, first_name, last_name, seen_at)}
+_pending_touches = {}   # {user_id: seen_at}
+# 缓冲在事件循环中写入、在数据库线程中取走
+_pending_lock = threading.Lock()
+
+def upsert_user(user_id, username=None, first_name=None, last_name=None):
+    """记录用户资料和活跃时间（仅写入内存缓冲，由 flush_user_activity 批量落盘）"""
+    with _pending_lock:
+        _pending_profiles[user_id] = (username, first_name, last_name, time.time())
+
+def touch_user(user_id):
+    """记录用户最后活跃时间（仅写入内存缓冲）"""
+    with _pending_lock:
+        _pending_touches[user_id] = time.time()
+
+def flush_user_activity():
+    """将缓冲中的用户资料和活跃时间在一个事务内写入 User 表"""
+    global _pending_profiles, _pending_touches
+    with _pending_lock:
+        if not _pending_profiles and not _pending_touches:
+            return 0
+        profiles, _pending_profiles = _pending_profiles, {}
+        touches, _pending_touches = _pending_touches, {}
+    profile_rows = []
+    for user_id, (username, first_name, last_name, seen_at) in profiles.items():
+        seen_at = max(seen_at, touches.pop(user_id, 0))
+        seen = datetime.fromtimestamp(seen_at).isoformat()
+        profile_rows.append((user_id, username, first_name, last_name, seen, seen))
+    touch_rows = [(datetime.fromtimestamp(seen_at).isoformat(), user_id) for user_id, seen_at in touches.items()]
+    with transaction():
+        conn.executemany(
+            """
+            INSERT INTO User (user_id, username, first_name, last_name, joined_at, last_active)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                last_active = MAX(COALESCE(last_active, ''), excluded.last_active),
+                is_active = 1,
+                inactive_reason = NULL
+            """,
+            profile_rows
+        )
+        conn.executemany(
+            "UPDATE User SET last_active = MAX(COALESCE(last_active, ''), ?), is_active = 1, inactive_reason = NULL WHERE user_id = ?",
+            touch_rows
+        )
+    return len(profile_rows) + len(touch_rows)
+
+async def activity_flush_loop(interval):
+    """按固定间隔落盘活跃度缓冲，取消时做最后一次落盘"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_db(flush_user_activity)
+            except Exception as e:
+                logger.error("用户活跃度落盘失败: %s", e)
+    finally:
+        await run_db(flush_user_activity)
+
+def get_all_users():
+    """获取所有用户（按 user_id 排序）"""
+    flush_user_activity()
+    cursor = conn.execute("SELECT user_id, username, first_name, last_name, joined_at, last_active FROM User ORDER BY user_id")
+    keys = ("user_id", "username", "first_name", "last_name", "joined_at", "last_active")
+    return [dict(zip(keys, row)) for row in cursor]
+
+def count_users(include_inactive=False):
+    """用户总数，默认不含已拉黑/注销的用户"""
+    flush_user_activity()
+    if include_inactive:
+        return conn.execute("SELECT COUNT(*) FROM User").fetchone()[0]
+    return conn.execute("SELECT COUNT(*) FROM User WHERE is_active = 1").fetchone()[0]
+
+def get_user_stats():
+    """用户统计：可触达总数、活跃数、已失效数、今日新增"""
+    flush_user_activity()
+    today = datetime.now().date()
+    start = today.isoformat()
+    end = (today + timedelta(days=1)).isoformat()
+    total, active, inactive = conn.execute(
+        "SELECT SUM(is_active = 1), SUM(is_active = 1 AND last_active IS NOT NULL), SUM(is_active = 0) FROM User"
+    ).fetchone()
+    today_new = conn.execute(
+        "SELECT COUNT(*) FROM User WHERE joined_at >= ? AND joined_at < ? AND is_active = 1", (start, end)
+    ).fetchone()[0]
+    return {"total": total or 0, "active": active or 0, "inactive": inactive or 0, "today_new": today_new}
+
+migrate_users_json()
+migrate_follow_stats()
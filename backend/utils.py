@@ -1,15 +1,19 @@
 import os
-import sqlite3
+import copy
+import asyncio
 import json
+import hashlib
+import time
 import string
-import random
-from datetime import datetime
+import sqlite3
+import secrets
+import logging
+from datetime import datetime, timedelta, timezone
 from telegram import InputMediaPhoto, InputMediaVideo
+from backend.cache import LRUCache
+from backend.db import conn, transaction, run_db, run_read, has_unflushed_writes
 
-DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "storage", "mapping.db"))
-if not os.path.exists(os.path.dirname(DB_PATH)):
-    os.makedirs(os.path.dirname(DB_PATH))
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+logger = logging.getLogger(__name__)
 
 # 初始化表结构
 conn.execute("""
@@ -20,27 +24,380 @@ CREATE TABLE IF NOT EXISTS ContentGroup (
 );
 """)
 
-# 生成唯一 group_id
-def generate_group_id(length=8):
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+# 数据库结构版本（PRAGMA user_version），每次改表结构加 1 并在 _migrations 中补充升级步骤
+SCHEMA_VERSION = 2
+
+def _migrate_to_v1():
+    """
+    内容拆分为 ContentItem 行：每条内容一行（position），相册的子媒体 sub_position 从 1 开始，
+    相册本身占 sub_position = 0 的一行；type/file_id/caption 之外的字段存入 data（JSON）。
+    ContentGroup 增加 creator_id，created_at 统一为带时区的 UTC ISO 字符串，旧的 JSON 整块数据迁移后清空。
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(ContentGroup)")}
+    if "creator_id" not in columns:
+        conn.execute("ALTER TABLE ContentGroup ADD COLUMN creator_id INTEGER")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ContentItem (
+        group_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        sub_position INTEGER NOT NULL DEFAULT 0,
+        type TEXT NOT NULL,
+        file_id TEXT,
+        caption TEXT,
+        data TEXT,
+        PRIMARY KEY (group_id, position, sub_position)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_content_group_created_at ON ContentGroup (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_content_group_creator ON ContentGroup (creator_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_content_item_file_id ON ContentItem (file_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_content_item_type ON ContentItem (type)")
+    for group_id, created_at in conn.execute("SELECT group_id, created_at FROM ContentGroup").fetchall():
+        conn.execute("UPDATE ContentGroup SET created_at = ? WHERE group_id = ?", (_normalize_timestamp(created_at), group_id))
+    rows = conn.execute("SELECT group_id, channel_msg_ids FROM ContentGroup WHERE channel_msg_ids IS NOT NULL").fetchall()
+    migrated = 0
+    for group_id, blob in rows:
+        try:
+            group_items = json.loads(blob)
+        except ValueError:
+            logger.warning("内容组 %s 数据损坏，保留原始数据，跳过迁移（该链接按不存在处理）", group_id)
+            continue
+        conn.executemany("INSERT OR REPLACE INTO ContentItem VALUES (?, ?, ?, ?, ?, ?, ?)", _item_rows(group_id, group_items))
+        conn.execute("UPDATE ContentGroup SET channel_msg_ids = NULL WHERE group_id = ?", (group_id,))
+        migrated += 1
+    if migrated:
+        logger.info("已将 %s 个内容组迁移到 ContentItem 表", migrated)
+
+def _migrate_to_v2():
+    """
+    内容去重：ContentGroup 增加 fingerprint（内容指纹）和 channel_id/channel_msg_id（发布到的频道消息）；
+    MediaIndex 按 file_unique_id 记录每个媒体的存储形式（类型、file_id）、首次收录的内容组和所在的频道消息。
+    已有内容组补算指纹（旧数据没有 file_unique_id，按 file_id 计算）。
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(ContentGroup)")}
+    for column, column_type in (("fingerprint", "TEXT"), ("channel_id", "TEXT"), ("channel_msg_id", "INTEGER")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE ContentGroup ADD COLUMN {column} {column_type}")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS MediaIndex (
+        file_unique_id TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        group_id TEXT,
+        channel_id TEXT,
+        channel_msg_id INTEGER
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_content_group_fingerprint ON ContentGroup (fingerprint)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_index_group ON MediaIndex (group_id)")
+    group_ids = [row[0] for row in conn.execute("SELECT group_id FROM ContentGroup WHERE fingerprint IS NULL")]
+    for group_id in group_ids:
+        group, _ = _load_group(conn, group_id)
+        if group is None:
+            continue
+        conn.execute("UPDATE ContentGroup SET fingerprint = ? WHERE group_id = ?", (content_fingerprint(group['items']), group_id))
+    if group_ids:
+        logger.info("已为 %s 个内容组计算内容指纹", len(group_ids))
+
+_migrations = {1: _migrate_to_v1, 2: _migrate_to_v2}
+
+def utc_now():
+    """当前 UTC 时间，ISO 格式（带 +00:00），字符串顺序即时间顺序"""
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+def _normalize_timestamp(value):
+    """旧数据的 datetime.utcnow() 字符串（无时区）转换为 utc_now() 的格式"""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value))
+    except ValueError:
+        return value
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat(timespec='seconds')
+
+def _to_timestamp(value):
+    """查询参数（datetime 或 ISO 字符串）转换为 utc_now() 的格式；created_at 列为 NUMERIC 亲和性，不能直接比较 '2024' 这类字符串"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    timestamp = _normalize_timestamp(value)
+    datetime.fromisoformat(timestamp)  # 无法解析时抛出 ValueError
+    return timestamp
+
+def _split_item(item):
+    data = {k: v for k, v in item.items() if k not in ('type', 'file_id', 'caption', 'items')}
+    return item['type'], item.get('file_id'), item.get('caption'), json.dumps(data, ensure_ascii=False) if data else None
+
+def _item_rows(group_id, group_items):
+    rows = []
+    for position, item in enumerate(group_items):
+        rows.append((group_id, position, 0) + _split_item(item))
+        if item['type'] == 'media_group':
+            for sub_position, child in enumerate(item['items'], 1):
+                rows.append((group_id, position, sub_position) + _split_item(child))
+    return rows
+
+def _join_item(type_, file_id, caption, data):
+    item = {'type': type_}
+    if file_id is not None:
+        item['file_id'] = file_id
+    if caption is not None:
+        item['caption'] = caption
+    if data:
+        item.update(json.loads(data))
+    return item
+
+def _fingerprint_item(item):
+    """参与指纹计算的字段：媒体按 file_unique_id 识别（同一文件每次转发的 file_id 都可能不同），没有时用 file_id"""
+    key = {k: v for k, v in item.items() if k not in ('file_id', 'file_unique_id', 'items', 'media_group_id') and v not in (None, '')}
+    if item.get('file_unique_id') or item.get('file_id'):
+        key['file'] = item.get('file_unique_id') or item['file_id']
+    if item['type'] == 'media_group':
+        key['items'] = [_fingerprint_item(child) for child in item['items']]
+    return key
+
+def content_fingerprint(group_items):
+    """内容组的指纹：内容（类型、文本、说明、文件）相同的组指纹相同"""
+    canonical = json.dumps([_fingerprint_item(item) for item in group_items], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _iter_media(group_items, channel_msg_ids=None):
+    """依次给出 (媒体条目, 所在频道消息ID或 None)；channel_msg_ids 与 group_items 对应，每项为该条内容的频道消息ID列表"""
+    for index, item in enumerate(group_items):
+        message_ids = channel_msg_ids[index] if channel_msg_ids and index < len(channel_msg_ids) else []
+        children = item['items'] if item['type'] == 'media_group' else [item]
+        if len(message_ids) != len(children):
+            message_ids = [None] * len(children)
+        for child, message_id in zip(children, message_ids):
+            if child.get('file_unique_id') and child.get('file_id'):
+                yield child, message_id
+
+def migrate_schema():
+    """按 PRAGMA user_version 依次执行未完成的升级步骤，每步在一个事务中完成"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    while version < SCHEMA_VERSION:
+        version += 1
+        with transaction():
+            _migrations[version]()
+            conn.execute(f"PRAGMA user_version = {version}")
+
+# 内容组保留天数：超过的内容组（及其条目、媒体索引）由 content_expiry_loop 定期删除，链接随之失效；0 为永久保留
+CONTENT_RETENTION_DAYS = float(os.getenv("CONTENT_RETENTION_DAYS", "0"))
+CONTENT_EXPIRY_INTERVAL = float(os.getenv("CONTENT_EXPIRY_INTERVAL", "3600"))
+
+# 热门内容缓存：按条目数和近似字节数双重限制
+group_cache = LRUCache(
+    maxsize=int(os.getenv("GROUP_CACHE_SIZE", "2000")),
+    max_bytes=int(os.getenv("GROUP_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+)
+# 不存在的 group_id（失效或错误的链接）短时间缓存，同一个失效链接被大量请求时不再反复查库
+missing_group_cache = LRUCache(
+    maxsize=int(os.getenv("GROUP_MISS_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("GROUP_MISS_TTL", "30"))
+)
+
+# group_id 编码：base62，字符按 ASCII 顺序排列，定长编码的字符串顺序与数值顺序一致
+GROUP_ID_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+# 前 6 位为创建时间（秒），后 8 位为随机数（与旧版 8 位随机ID同样难以猜测）
+GROUP_ID_TIME_LENGTH = 6
+GROUP_ID_RANDOM_LENGTH = 8
+# 自动分配的 group_id 主键冲突时的最多尝试次数
+GROUP_ID_MAX_ATTEMPTS = 5
+
+def _base62(value, length):
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 62)
+        chars.append(GROUP_ID_ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+def generate_group_id():
+    """
+    生成 group_id：时间前缀 + secrets 随机数，按字符串排序即按创建时间排序（精确到秒），
+    新内容组在主键索引和 ContentItem 中都追加在末尾。唯一性由主键保证，见 store_group_mapping
+    """
+    return _base62(int(time.time()), GROUP_ID_TIME_LENGTH) + _base62(secrets.randbelow(62 ** GROUP_ID_RANDOM_LENGTH), GROUP_ID_RANDOM_LENGTH)
 
 # 新的内容组存储结构
 # [{type: 'photo', file_id: ..., caption: ...}, {type: 'text', text: ...}, ...]
 
-def store_group_mapping(group_id, group_items):
-    conn.execute(
-        "INSERT OR REPLACE INTO ContentGroup VALUES (?, ?, ?)",
-        (group_id, json.dumps(group_items, ensure_ascii=False), datetime.utcnow())
-    )
-    conn.commit()
+def find_group_by_fingerprint(fingerprint):
+    """按内容指纹查找已存储的内容组（最早的一个），返回 {group_id, channel_id, channel_msg_id} 或 None"""
+    row = conn.execute(
+        "SELECT group_id, channel_id, channel_msg_id FROM ContentGroup WHERE fingerprint = ? ORDER BY created_at LIMIT 1",
+        (fingerprint,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {'group_id': row[0], 'channel_id': row[1], 'channel_msg_id': row[2]}
+
+def find_existing_group(group_items):
+    """内容相同的已存储内容组，没有时返回 None"""
+    return find_group_by_fingerprint(content_fingerprint(group_items))
+
+def store_group_mapping(group_id, group_items, creator_id=None, channel_id=None, channel_msg_ids=None):
+    """
+    存储内容组，按内容去重：已有内容相同的组时不再写入，返回已有的 group_id；否则写入并返回 group_id。
+    group_id 为 None 时自动分配：直接插入，主键冲突（极少发生）时换一个ID重试，不需要事先查询；
+    指定的 group_id 已存在时抛出 sqlite3.IntegrityError，不会覆盖已有内容。
+    channel_id / channel_msg_ids（与 group_items 对应的频道消息ID列表）为内容发布到的频道消息，
+    记录到 ContentGroup 和 MediaIndex；已收录过的媒体沿用 MediaIndex 中的 file_id。
+    """
+    group_items = copy.deepcopy(group_items)
+    fingerprint = content_fingerprint(group_items)
+    with transaction():
+        existing = conn.execute(
+            "SELECT group_id FROM ContentGroup WHERE fingerprint = ? AND group_id IS NOT ? ORDER BY created_at LIMIT 1",
+            (fingerprint, group_id)
+        ).fetchone()
+        if existing:
+            return existing[0]
+        for item, _ in _iter_media(group_items):
+            media = find_media(item['file_unique_id'])
+            if media:
+                item['file_id'] = media['file_id']
+        last_msg_id = None
+        if channel_msg_ids:
+            last_msg_id = next((ids[-1] for ids in reversed(channel_msg_ids) if ids), None)
+        for attempt in range(GROUP_ID_MAX_ATTEMPTS):
+            new_group_id = group_id or generate_group_id()
+            try:
+                conn.execute(
+                    "INSERT INTO ContentGroup (group_id, channel_msg_ids, created_at, creator_id, fingerprint, channel_id, channel_msg_id) VALUES (?, NULL, ?, ?, ?, ?, ?)",
+                    (new_group_id, utc_now(), creator_id, fingerprint, str(channel_id) if channel_id else None, last_msg_id)
+                )
+                break
+            except sqlite3.IntegrityError:
+                if group_id is not None or attempt == GROUP_ID_MAX_ATTEMPTS - 1:
+                    raise
+                logger.warning("group_id %s 已存在，重新生成", new_group_id)
+        group_id = new_group_id
+        conn.executemany("INSERT INTO ContentItem VALUES (?, ?, ?, ?, ?, ?, ?)", _item_rows(group_id, group_items))
+        conn.executemany(
+            """
+            INSERT INTO MediaIndex (file_unique_id, type, file_id, group_id, channel_id, channel_msg_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file_unique_id) DO UPDATE SET
+                channel_id = COALESCE(MediaIndex.channel_id, excluded.channel_id),
+                channel_msg_id = COALESCE(MediaIndex.channel_msg_id, excluded.channel_msg_id)
+            """,
+            [
+                (item['file_unique_id'], item['type'], item['file_id'], group_id,
+                 str(channel_id) if channel_id and message_id else None, message_id)
+                for item, message_id in _iter_media(group_items, channel_msg_ids)
+            ]
+        )
+    group_cache.pop(group_id)
+    missing_group_cache.pop(group_id)
+    return group_id
+
+def _load_group(connection, group_id):
+    """
+    从数据库读取内容组，返回 (group, 近似字节数)；不存在或没有任何内容时返回 (None, 0)
+    （如旧版数据损坏、迁移时未能拆分的内容组），调用方按链接失效处理
+    """
+    rows = connection.execute(
+        "SELECT position, sub_position, type, file_id, caption, data FROM ContentItem WHERE group_id = ? ORDER BY position, sub_position",
+        (group_id,)
+    ).fetchall()
+    if not rows:
+        return None, 0
+    group_items = []
+    size = 0
+    for position, sub_position, type_, file_id, caption, data in rows:
+        item = _join_item(type_, file_id, caption, data)
+        if sub_position:
+            group_items[-1]['items'].append(item)
+        else:
+            if type_ == 'media_group':
+                item['items'] = []
+            group_items.append(item)
+        size += 64 + len(file_id or '') + len(caption or '') + len(data or '')
+    return {'group_id': group_id, 'items': group_items}, size
 
 def get_group_by_id(group_id):
-    cursor = conn.execute("SELECT channel_msg_ids FROM ContentGroup WHERE group_id = ?", (group_id,))
-    row = cursor.fetchone()
-    if not row:
+    """读取内容组，优先命中缓存；返回的字典为缓存共享对象，调用方不要修改"""
+    group = group_cache.get(group_id)
+    if group is not None:
+        return group
+    group, size = _load_group(conn, group_id)
+    if group is not None:
+        group_cache.set(group_id, group, size=size)
+    return group
+
+async def get_group(group_id):
+    """
+    异步读取内容组：缓存命中直接返回；未命中时在只读线程查询，不排在写操作之后。
+    刚写入还未提交的内容组只读线程看不到，只有数据库线程有未提交的写入时才再到数据库线程查一次。
+    不存在的 group_id 记入 missing_group_cache，过期前直接返回 None
+    """
+    group = group_cache.get(group_id)
+    if group is not None:
+        return group
+    if missing_group_cache.get(group_id):
+        return None
+    # 读取前没有未提交的写入时，已存在的内容组只读线程都能读到，查不到即不存在
+    unflushed = has_unflushed_writes()
+    group, size = await run_read(_load_group, group_id)
+    if group is None:
+        if unflushed:
+            group = await run_db(get_group_by_id, group_id)
+        if group is None:
+            missing_group_cache.set(group_id, True)
+        return group
+    group_cache.set(group_id, group, size=size)
+    return group
+
+def find_media(file_unique_id):
+    """媒体索引：{file_unique_id, type, file_id, group_id, channel_id, channel_msg_id}，未收录时返回 None"""
+    row = conn.execute(
+        "SELECT file_unique_id, type, file_id, group_id, channel_id, channel_msg_id FROM MediaIndex WHERE file_unique_id = ?",
+        (file_unique_id,)
+    ).fetchone()
+    if row is None:
         return None
-    group_items = json.loads(row[0])
-    return {'group_id': group_id, 'items': group_items}
+    return dict(zip(('file_unique_id', 'type', 'file_id', 'group_id', 'channel_id', 'channel_msg_id'), row))
+
+def count_groups_since(since):
+    """since（UTC datetime 或 ISO 字符串）之后创建的内容组数量"""
+    return conn.execute("SELECT COUNT(*) FROM ContentGroup WHERE created_at >= ?", (_to_timestamp(since),)).fetchone()[0]
+
+def get_group_stats():
+    """内容组统计：总数、今日（本地时间）新增、近 7 天新增（走 created_at 索引）"""
+    midnight = datetime.now().astimezone().replace(hour=0, minute=0, second=0, microsecond=0)
+    return {
+        "total": conn.execute("SELECT COUNT(*) FROM ContentGroup").fetchone()[0],
+        "today": count_groups_since(midnight),
+        "week": count_groups_since(midnight - timedelta(days=6)),
+    }
+
+def delete_groups_before(before):
+    """删除 before 之前创建的内容组及其条目，返回删除数量（过期清理，需在数据库线程上执行）"""
+    before = _to_timestamp(before)
+    with transaction():
+        group_ids = [row[0] for row in conn.execute("SELECT group_id FROM ContentGroup WHERE created_at < ?", (before,))]
+        conn.execute("DELETE FROM ContentItem WHERE group_id IN (SELECT group_id FROM ContentGroup WHERE created_at < ?)", (before,))
+        conn.execute("DELETE FROM MediaIndex WHERE group_id IN (SELECT group_id FROM ContentGroup WHERE created_at < ?)", (before,))
+        conn.execute("DELETE FROM ContentGroup WHERE created_at < ?", (before,))
+    for group_id in group_ids:
+        group_cache.pop(group_id)
+    return len(group_ids)
+
+async def content_expiry_loop(retention_days=CONTENT_RETENTION_DAYS, interval=CONTENT_EXPIRY_INTERVAL):
+    """定期删除超过保留天数的内容组"""
+    while True:
+        try:
+            before = datetime.now(timezone.utc) - timedelta(days=retention_days)
+            deleted = await run_db(delete_groups_before, before)
+            if deleted:
+                logger.info("已删除 %s 个超过 %s 天的内容组", deleted, retention_days)
+        except Exception as e:
+            logger.error("清理过期内容组失败: %s", e)
+        await asyncio.sleep(interval)
+
+def get_group_cache_stats():
+    return group_cache.stats()
 
 async def save_group_to_channel(messages, bot):
     channel_id = int(os.getenv("CHANNEL_ID"))
@@ -78,4 +435,7 @@ def generate_link(group_id):
         return f"⚠️ 链接生成失败：请设置BOT_USERNAME环境变量\nGroup ID: {group_id}"
     
     # 使用 start 参数，让用户点击后直接打开机器人
-    return f"https://t.me/{bot_username}?start={group_id}" 
+    return f"https://t.me/{bot_username}?start={group_id}"
+
+# 升级步骤会用到上面定义的函数（如 _load_group），在模块末尾执行
+migrate_schema()
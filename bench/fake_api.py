@@ -0,0 +1,172 @@
+import json
+import time
+import random
+import asyncio
+import logging
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+# 视为“发出消息”的方法，计入消息数和限流
+SEND_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendAudio", "sendAnimation",
+    "sendVoice", "sendSticker", "sendVideoNote", "sendLocation", "sendContact", "sendPoll",
+    "sendDice", "sendVenue", "sendMediaGroup", "copyMessage", "forwardMessage",
+}
+
+class FakeBotAPI:
+    """
+    本地模拟的 Bot API 服务器（http://127.0.0.1:端口/bot<token>/<方法>），用于离线压测：
+    - latency / jitter：每个请求的响应延迟（秒），jitter 为随机附加的最大值
+    - retry_after_rate：发送请求随机返回 429 RetryAfter 的比例
+    - rate_limit：每秒最多接受的消息数（模拟 Telegram 全局限流），超出返回 429，0 为不限
+    - forbidden_rate：被拉黑的用户比例（按用户ID固定），向其发送返回 403 Forbidden；protected 中的聊天不受影响
+    """
+
+    def __init__(self, latency=0.02, jitter=0.01, retry_after_rate=0.0, retry_after=1,
+                 rate_limit=0, forbidden_rate=0.0, protected=(), listen="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit
+        self.forbidden_rate = forbidden_rate
+        self.protected = set(protected)
+        self.listen = listen
+        self.port = port
+        self.calls = {}            # {方法: 次数}
+        self.messages = 0          # 已接受的消息数（相册按条数计）
+        self.retry_after_count = 0
+        self.forbidden_count = 0
+        self.last_delivery = {}    # {chat_id: 最后一次接受发送的时间（perf_counter）}
+        self._message_id = 0
+        self._window = (0, 0)      # (当前秒, 本秒已接受的消息数)
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.listen}:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("模拟 Bot API 已监听 %s", self.base_url)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def snapshot(self):
+        """当前计数，用于计算一段时间内的增量"""
+        return {"messages": self.messages, "retry_after": self.retry_after_count, "forbidden": self.forbidden_count}
+
+    def is_forbidden(self, chat_id):
+        if chat_id in self.protected or chat_id < 0 or not self.forbidden_rate:
+            return False
+        return random.Random(chat_id).random() < self.forbidden_rate
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                parts = request_line.decode("latin-1").split()
+                method = parts[1].rstrip("/").rsplit("/", 1)[-1] if len(parts) >= 2 else ""
+                params = {}
+                if headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+                    params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+                elif headers.get("content-type", "").startswith("application/json") and body:
+                    params = json.loads(body)
+                delay = self.latency + random.random() * self.jitter
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                status, payload = self.handle(method, params)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def handle(self, method, params):
+        """返回 (HTTP 状态, 响应 JSON)"""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        chat_id = _int(params.get("chat_id"))
+        if method in SEND_METHODS:
+            count = len(json.loads(params["media"])) if method == "sendMediaGroup" and "media" in params else 1
+            if self.is_forbidden(chat_id):
+                self.forbidden_count += 1
+                return "403 Forbidden", {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+            if (self.retry_after_rate and random.random() < self.retry_after_rate) or not self._take(count):
+                self.retry_after_count += 1
+                return "429 Too Many Requests", {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            self.messages += count
+            self.last_delivery[chat_id] = time.perf_counter()
+            if method == "sendMediaGroup":
+                return "200 OK", {"ok": True, "result": [self._message(chat_id) for _ in range(count)]}
+            if method == "copyMessage":
+                return "200 OK", {"ok": True, "result": {"message_id": self._next_message_id()}}
+            return "200 OK", {"ok": True, "result": self._message(chat_id, params.get("text"))}
+        if method == "getMe":
+            return "200 OK", {"ok": True, "result": {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+        if method == "getChat":
+            return "200 OK", {"ok": True, "result": _chat(chat_id)}
+        if method == "getChatMember":
+            user_id = _int(params.get("user_id"))
+            return "200 OK", {"ok": True, "result": {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"}}}
+        if method in ("editMessageText", "editMessageCaption", "editMessageReplyMarkup"):
+            return "200 OK", {"ok": True, "result": self._message(chat_id, params.get("text"), message_id=_int(params.get("message_id")))}
+        return "200 OK", {"ok": True, "result": True}
+
+    def _take(self, count):
+        """全局限流：本秒内已接受的消息数未超过 rate_limit 时计入并返回 True"""
+        if not self.rate_limit:
+            return True
+        second = int(time.monotonic())
+        current, used = self._window
+        if current != second:
+            used = 0
+        if used + count > self.rate_limit:
+            self._window = (second, used)
+            return False
+        self._window = (second, used + count)
+        return True
+
+    def _next_message_id(self):
+        self._message_id += 1
+        return self._message_id
+
+    def _message(self, chat_id, text=None, message_id=None):
+        message = {"message_id": message_id or self._next_message_id(), "date": int(time.time()), "chat": _chat(chat_id)}
+        if text is not None:
+            message["text"] = text
+        return message
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def _chat(chat_id):
+    if chat_id < 0:
+        return {"id": chat_id, "type": "channel", "title": f"channel {chat_id}", "username": f"bench_channel_{-chat_id}"}
+    return {"id": chat_id, "type": "private", "first_name": f"u{chat_id}"}
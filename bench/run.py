@@ -0,0 +1,312 @@
+"""
+离线压测：在本地模拟的 Bot API（bench/fake_api.py）上运行 bot/main.py 中的 Application，
+回放合成的更新并输出各场景的延迟（p50/p99）和每秒消息数。
+
+    python -m bench.run                       # 运行全部场景
+    python -m bench.run start broadcast --broadcast-users 20000
+
+数据写入临时目录，不会读写 storage/；不会访问真实的 Telegram。
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from bench.fake_api import FakeBotAPI
+
+WORKLOADS = ("start", "submit", "broadcast", "fanout")
+
+# 合成数据的ID范围
+ADMIN_BASE = 900000000
+USER_BASE = 1000000000
+CHANNEL_BASE = -1001000000000
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def format_ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+class Bench:
+    """把合成的更新放入 application.update_queue，记录每个更新从入队到处理完成的耗时"""
+
+    def __init__(self, application, api):
+        self.application = application
+        self.api = api
+        self.results = []
+        self.latencies = {}  # {update_id: 秒}
+        self._started = {}
+        self._update_id = 0
+        self._message_id = 0
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        process_update = application.process_update
+
+        async def tracked(update):
+            try:
+                return await process_update(update)
+            finally:
+                started = self._started.pop(update.update_id, None)
+                if started is not None:
+                    self.latencies[update.update_id] = time.perf_counter() - started
+                    self._pending -= 1
+                    if not self._pending:
+                        self._idle.set()
+        application.process_update = tracked
+
+    def _next_update_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    def _next_message_id(self):
+        self._message_id += 1
+        return self._message_id
+
+    def message(self, user_id, text=None, photo=None, media_group_id=None):
+        message = {
+            "message_id": self._next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"u{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"},
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if photo is not None:
+            message["photo"] = [{"file_id": photo, "file_unique_id": photo, "width": 1280, "height": 720}]
+        if media_group_id is not None:
+            message["media_group_id"] = media_group_id
+        return {"update_id": self._next_update_id(), "message": message}
+
+    def callback(self, user_id, data):
+        user = {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"}
+        return {
+            "update_id": self._next_update_id(),
+            "callback_query": {
+                "id": str(self._update_id),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": self._next_message_id(),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private", "first_name": f"u{user_id}"},
+                    "text": "bench",
+                },
+            },
+        }
+
+    async def inject(self, updates):
+        """依次放入更新队列，返回 update_id 列表"""
+        from telegram import Update
+        ids = []
+        for data in updates:
+            update = Update.de_json(data, self.application.bot)
+            self._started[update.update_id] = time.perf_counter()
+            self._pending += 1
+            self._idle.clear()
+            ids.append(update.update_id)
+            await self.application.update_queue.put(update)
+        return ids
+
+    async def wait_processed(self):
+        await self._idle.wait()
+
+    async def record(self, name, started, snapshot, update_ids, targets=None):
+        """等待后台发送完成后记录一个场景的结果；targets 为 {chat_id: 开始时间}，用于计算送达延迟"""
+        from bot.delivery import drain_background_tasks
+        await self.wait_processed()
+        await drain_background_tasks(timeout=600)
+        elapsed = time.perf_counter() - started
+        after = self.api.snapshot()
+        updates = [self.latencies[i] for i in update_ids if i in self.latencies]
+        deliveries = []
+        for chat_id, start in (targets or {}).items():
+            delivered = self.api.last_delivery.get(chat_id)
+            if delivered is not None and delivered >= start:
+                deliveries.append(delivered - start)
+        messages = after["messages"] - snapshot["messages"]
+        self.results.append({
+            "name": name,
+            "updates": len(updates),
+            "elapsed": elapsed,
+            "update_p50": percentile(updates, 0.5),
+            "update_p99": percentile(updates, 0.99),
+            "delivery_p50": percentile(deliveries, 0.5),
+            "delivery_p99": percentile(deliveries, 0.99),
+            "messages": messages,
+            "rate": messages / elapsed if elapsed else 0,
+            "retry_after": after["retry_after"] - snapshot["retry_after"],
+            "forbidden": after["forbidden"] - snapshot["forbidden"],
+        })
+        print(f"  {name}: {elapsed:.1f}s，{messages} 条消息", file=sys.stderr)
+
+    def report(self):
+        header = ("场景", "更新数", "耗时(s)", "更新p50(ms)", "更新p99(ms)", "送达p50(ms)", "送达p99(ms)", "消息数", "消息/秒", "429", "403")
+        rows = [header]
+        for r in self.results:
+            rows.append((
+                r["name"], str(r["updates"]), f"{r['elapsed']:.1f}",
+                format_ms(r["update_p50"]), format_ms(r["update_p99"]),
+                format_ms(r["delivery_p50"]), format_ms(r["delivery_p99"]),
+                str(r["messages"]), f"{r['rate']:.0f}", str(r["retry_after"]), str(r["forbidden"]),
+            ))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        for row in rows:
+            print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+async def run_start_storm(bench, admins, users):
+    """大量用户同时通过同一个链接 /start 领取内容（1 条文本 + 3 张图片的相册）"""
+    from backend.db import run_db
+    from backend.utils import store_group_mapping
+    group_id = "benchstart"
+    items = [
+        {'type': 'text', 'text': 'bench'},
+        {'type': 'media_group', 'items': [{'type': 'photo', 'file_id': f'bench-photo-{i}', 'caption': None} for i in range(3)]},
+    ]
+    await run_db(store_group_mapping, group_id, items, creator_id=admins[0])
+    user_ids = [USER_BASE + i for i in range(users)]
+    bench.api.protected.update(user_ids)
+    started, snapshot = time.perf_counter(), bench.api.snapshot()
+    update_ids = await bench.inject(bench.message(user_id, f"/start {group_id}") for user_id in user_ids)
+    await bench.record("start", started, snapshot, update_ids, {user_id: started for user_id in user_ids})
+
+async def run_submissions(bench, admins, count, album):
+    """大量用户各投稿一个相册并点击完成，投稿发给所有管理员审核"""
+    user_ids = [USER_BASE + 1000000 + i for i in range(count)]
+    bench.api.protected.update(user_ids)
+    started, snapshot = time.perf_counter(), bench.api.snapshot()
+    update_ids = await bench.inject(
+        bench.message(user_id, photo=f"submit-{user_id}-{i}", media_group_id=f"album-{user_id}")
+        for user_id in user_ids for i in range(album)
+    )
+    await bench.wait_processed()
+    # 相册收齐后（约 2.5 秒）才会写入草稿并提示用户
+    while not all(user_id in bench.api.last_delivery for user_id in user_ids):
+        await asyncio.sleep(0.1)
+    await bench.record("submit-album", started, snapshot, update_ids, {user_id: started for user_id in user_ids})
+    started, snapshot = time.perf_counter(), bench.api.snapshot()
+    update_ids = await bench.inject(bench.callback(user_id, "finish_signed") for user_id in user_ids)
+    await bench.record("submit-finish", started, snapshot, update_ids, {admin_id: started for admin_id in admins})
+
+async def run_broadcast(bench, admins, users):
+    """向大量用户广播一条文本：管理员 /broadcast start、发送内容、确认，等待广播任务完成"""
+    from backend.db import run_db
+    from backend.users import upsert_user, flush_user_activity
+    from bot.broadcast import active_jobs
+    user_ids = [USER_BASE + 2000000 + i for i in range(users)]
+
+    def insert_users():
+        for user_id in user_ids:
+            upsert_user(user_id)
+        flush_user_activity()
+    await run_db(insert_users)
+    admin_id = admins[0]
+    await bench.inject([bench.message(admin_id, "/broadcast start"), bench.message(admin_id, "bench broadcast")])
+    await bench.wait_processed()
+    started, snapshot = time.perf_counter(), bench.api.snapshot()
+    update_ids = await bench.inject([bench.callback(admin_id, "confirm_broadcast")])
+    await bench.wait_processed()
+    while active_jobs:
+        await asyncio.sleep(0.1)
+    await bench.record("broadcast", started, snapshot, update_ids, {user_id: started for user_id in user_ids})
+
+async def run_fanout(bench, admins, channels, posts):
+    """管理员发布内容（1 条文本 + 3 张图片）到多个绑定频道：主频道发布后复制到其他频道，链接发到备用频道"""
+    started, snapshot = time.perf_counter(), bench.api.snapshot()
+    updates, finish = [], []
+    for i in range(posts):
+        admin_id = admins[i % len(admins)]
+        updates.append(bench.message(admin_id, f"post {i}"))
+        updates.extend(bench.message(admin_id, photo=f"post-{i}-{j}") for j in range(3))
+        finish.append(bench.callback(admin_id, "finish_signed"))
+        updates.append(finish[-1])
+    update_ids = await bench.inject(updates)
+    finish_ids = {data["update_id"] for data in finish}
+    await bench.record("fanout", started, snapshot, [i for i in update_ids if i in finish_ids], {channel_id: started for channel_id in channels})
+
+async def main(args):
+    api = FakeBotAPI(
+        latency=args.latency, jitter=args.jitter, retry_after_rate=args.retry_after_rate,
+        retry_after=args.retry_after, rate_limit=args.api_rate, forbidden_rate=args.forbidden_rate,
+    )
+    await api.start()
+    data_dir = tempfile.mkdtemp(prefix="tg-nrcc-bench-")
+    # 必须在导入 bot/backend 之前设置：数据库路径、Bot API 地址等在导入时读取
+    os.environ.update(STORAGE_DIR=data_dir, BOT_TOKEN="123456:bench", TELEGRAM_API_URL=api.base_url, METRICS_PORT="0")
+    # 默认放开机器人自身的全局限速，测量的是处理能力而不是限速配置；可通过环境变量覆盖
+    os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "1000")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    from bot import main as bot_main
+    from backend.config import set_config_value
+
+    admins = [ADMIN_BASE + i for i in range(args.admins)]
+    channels = [CHANNEL_BASE - i for i in range(args.channels)]
+    set_config_value("admin_ids", admins)
+    set_config_value("bind_channels", [str(c) for c in channels])
+    set_config_value("backup_channels", [str(CHANNEL_BASE - args.channels)])
+    api.protected.update(admins)
+
+    application = bot_main.application
+    bench = Bench(application, api)
+    await application.initialize()
+    try:
+        await application.post_init(application)
+        await application.start()
+        for name in args.workloads:
+            print(f"运行场景 {name}...", file=sys.stderr)
+            if name == "start":
+                await run_start_storm(bench, admins, args.users)
+            elif name == "submit":
+                await run_submissions(bench, admins, args.submissions, args.album)
+            elif name == "broadcast":
+                await run_broadcast(bench, admins, args.broadcast_users)
+            elif name == "fanout":
+                await run_fanout(bench, admins, channels, args.posts)
+    finally:
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+        await api.stop()
+        if args.keep:
+            print(f"数据目录：{data_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    print(f"模拟 API：延迟 {args.latency * 1000:.0f}+{args.jitter * 1000:.0f}ms，429 比例 {args.retry_after_rate}，"
+          f"限流 {args.api_rate or '无'}/秒，拉黑比例 {args.forbidden_rate}；机器人限速 {os.environ['TELEGRAM_GLOBAL_RATE']}/秒")
+    bench.report()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="离线压测（模拟 Bot API）")
+    parser.add_argument("workloads", nargs="*", help=f"要运行的场景（{'/'.join(WORKLOADS)}），默认全部")
+    parser.add_argument("--users", type=int, default=1000, help="start：同时 /start 的用户数")
+    parser.add_argument("--submissions", type=int, default=200, help="submit：投稿用户数")
+    parser.add_argument("--album", type=int, default=4, help="submit：每个投稿相册的图片数")
+    parser.add_argument("--broadcast-users", type=int, default=100000, help="broadcast：广播用户数")
+    parser.add_argument("--channels", type=int, default=10, help="fanout：绑定频道数")
+    parser.add_argument("--posts", type=int, default=30, help="fanout：发布次数")
+    parser.add_argument("--admins", type=int, default=3, help="管理员数（审核投稿、轮流发布）")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟 API 响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.01, help="随机附加延迟的最大值（秒）")
+    parser.add_argument("--retry-after-rate", type=float, default=0.001, help="发送请求随机返回 429 的比例")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 响应中的 retry_after（秒）")
+    parser.add_argument("--api-rate", type=int, default=0, help="模拟 API 每秒最多接受的消息数，超出返回 429，0 为不限")
+    parser.add_argument("--forbidden-rate", type=float, default=0.05, help="拉黑机器人的用户比例（返回 403）")
+    parser.add_argument("--keep", action="store_true", help="保留临时数据目录")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+    args.workloads = args.workloads or list(WORKLOADS)
+    return args
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
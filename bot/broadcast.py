@@ -0,0 +1,246 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from bot.ratelimit import call_with_retry, classify_send_error, PER_CHAT_INTERVAL, ERROR_UNREACHABLE, ERROR_TRANSIENT
+from backend.db import run_db
+from backend.broadcasts import (
+    create_job, get_job, get_unfinished_jobs, get_retrying_user_ids, get_recipient_page, record_progress, finish_job,
+    get_failed_user_ids, count_retrying, is_cancel_requested,
+    JOB_DONE, JOB_CANCELLED, DELIVERY_SENT, DELIVERY_FAILED, DELIVERY_BLOCKED, DELIVERY_RETRYING,
+)
+
+logger = logging.getLogger(__name__)
+
+# 广播并发数与进度刷新间隔（秒）
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+# 投递结果每累计多少条写一次数据库（重启后最多重复发送这么多条）
+BROADCAST_PERSIST_BATCH = int(os.getenv("BROADCAST_PERSIST_BATCH", "50"))
+# 全部用户发送一轮后，对临时失败（超时、限流）的用户再补发的轮数
+BROADCAST_RETRY_ROUNDS = int(os.getenv("BROADCAST_RETRY_ROUNDS", "1"))
+
+# 正在运行的广播任务 {job_id: BroadcastJob}
+active_jobs = {}
+
+class BroadcastJob:
+    """后台广播任务：有界并发 + 全局限速，投递结果和游标持久化到数据库，重启后可从游标继续"""
+
+    def __init__(self, bot, job, send_item):
+        self.job_id = job["job_id"]
+        self.bot = bot
+        self.admin_id = job["admin_id"]
+        self.kind = job["kind"]
+        self.items = job["items"]
+        self.send_item = send_item
+        self.progress_chat_id = job["progress_chat_id"]
+        self.progress_message_id = job["progress_message_id"]
+        self.total = job["total"]
+        self.success_count = job["success_count"]
+        self.failed_count = job["failed_count"]
+        self.cancelled = bool(job["cancel_requested"])
+        self.started_at = None
+        self.task = None
+        self._cursor = job["recipient_cursor"]
+        self._reset_recipients(job)
+        self._in_flight = set()
+        self._results = []
+        self._processed = 0
+
+    @property
+    def done_count(self):
+        return self.success_count + self.failed_count
+
+    def cancel(self):
+        self.cancelled = True
+
+    async def send_to_user(self, chat_id):
+        """把全部内容发送给单个用户，同一聊天内的消息保持最小间隔"""
+        for i, item in enumerate(self.items):
+            if i:
+                await asyncio.sleep(PER_CHAT_INTERVAL)
+            await call_with_retry(self.send_item, item, self.bot, chat_id)
+
+    def _reset_recipients(self, job):
+        """重新开始一轮：先取 retrying 的用户，再从游标之后扫描"""
+        self._job = job
+        self._buffer = deque()
+        self._retrying_loaded = False
+        self._scan_after = job["recipient_cursor"]
+        self._scan_done = False
+        self._fetch_lock = asyncio.Lock()
+
+    async def _next_recipient(self):
+        """取下一个收件人 (user_id, from_scan)，缓冲为空时在数据库线程读取下一页；取完返回 None"""
+        async with self._fetch_lock:
+            if not self._buffer and not self._retrying_loaded:
+                self._retrying_loaded = True
+                self._buffer.extend((user_id, False) for user_id in await run_db(get_retrying_user_ids, self.job_id))
+            if not self._buffer and not self._scan_done:
+                page = await run_db(get_recipient_page, self._job, self._scan_after)
+                if page:
+                    self._scan_after = page[-1]
+                    self._buffer.extend((user_id, True) for user_id in page)
+                else:
+                    self._scan_done = True
+            return self._buffer.popleft() if self._buffer else None
+
+    async def _worker(self):
+        while not self.cancelled:
+            recipient = await self._next_recipient()
+            if recipient is None:
+                return
+            chat_id, from_scan = recipient
+            if from_scan:
+                self._cursor = chat_id
+                self._in_flight.add(chat_id)
+            else:
+                # 上次标记为 retrying 的用户已计入失败数，重试前先扣除
+                self.failed_count -= 1
+            try:
+                await self.send_to_user(chat_id)
+                self.success_count += 1
+                self._results.append((chat_id, DELIVERY_SENT, None))
+            except Exception as e:
+                self.failed_count += 1
+                kind = classify_send_error(e)
+                if kind == ERROR_UNREACHABLE:
+                    status = DELIVERY_BLOCKED
+                elif kind == ERROR_TRANSIENT:
+                    status = DELIVERY_RETRYING
+                else:
+                    status = DELIVERY_FAILED
+                self._results.append((chat_id, status, str(e)))
+                logger.warning("广播 %s 发送给用户 %s 失败: %s", self.job_id, chat_id, e)
+            # 被取消（停机）时保留在 _in_flight 中，游标不会越过它，重启后重发
+            self._in_flight.discard(chat_id)
+            self._processed += 1
+            if len(self._results) >= BROADCAST_PERSIST_BATCH:
+                await self._persist()
+
+    async def _persist(self):
+        """写入已完成的投递结果；游标只推进到仍在发送中的最小用户之前"""
+        results, self._results = self._results, []
+        cursor = min(self._in_flight) - 1 if self._in_flight else self._cursor
+        try:
+            await run_db(record_progress, self.job_id, cursor, results, self.success_count, self.failed_count)
+        except Exception as e:
+            self._results = results + self._results
+            logger.error("广播 %s 保存进度失败: %s", self.job_id, e)
+
+    def progress_text(self):
+        label = "广播" if self.kind == "broadcast" else "通知"
+        elapsed = max(time.monotonic() - self.started_at, 0.001) if self.started_at else 0.001
+        percent = self.done_count / self.total * 100 if self.total else 100
+        return (
+            f"📤 {label}发送中…\n\n"
+            f"• 进度：{self.done_count}/{self.total}（{percent:.1f}%）\n"
+            f"• 发送成功：{self.success_count} 人\n"
+            f"• 发送失败：{self.failed_count} 人\n"
+            f"• 速度：{self._processed / elapsed:.1f} 人/秒"
+        )
+
+    async def result_text(self):
+        label = "广播" if self.kind == "broadcast" else "系统通知"
+        title = f"⏹ {label}已取消！" if self.cancelled else f"✅ {label}发送完成！"
+        rate = self.success_count / self.total * 100 if self.total else 0
+        text = (
+            f"{title}\n\n"
+            f"📊 发送统计：\n"
+            f"• 总用户数：{self.total} 人\n"
+            f"• 已处理：{self.done_count} 人\n"
+            f"• 发送成功：{self.success_count} 人\n"
+            f"• 发送失败：{self.failed_count} 人\n"
+            f"• 成功率：{rate:.1f}%"
+        )
+        failed_users = await run_db(get_failed_user_ids, self.job_id)
+        if failed_users:
+            text += f"\n\n❌ 失败用户（前10个）：\n" + "\n".join(str(u) for u in failed_users)
+        return text
+
+    async def _edit_progress(self, text, reply_markup=None):
+        if not self.progress_chat_id or not self.progress_message_id:
+            return
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.progress_chat_id,
+                message_id=self.progress_message_id,
+                text=text,
+                reply_markup=reply_markup
+            )
+        except Exception as e:
+            logger.warning("更新广播进度失败: %s", e)
+
+    async def _check_cancel_requested(self):
+        """停止请求可能由其他工作进程收到并写入数据库"""
+        if not self.cancelled and await run_db(is_cancel_requested, self.job_id):
+            logger.info("广播 %s 收到停止请求", self.job_id)
+            self.cancel()
+
+    async def _report_progress(self):
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("⏹ 停止发送", callback_data=f"stop_broadcast_{self.job_id}")]
+        ])
+        last_text = None
+        while True:
+            if self._results:
+                await self._persist()
+            await self._check_cancel_requested()
+            text = self.progress_text()
+            if text != last_text:
+                await self._edit_progress(text, reply_markup=keyboard)
+                last_text = text
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+
+    async def run(self):
+        self.started_at = time.monotonic()
+        reporter = asyncio.create_task(self._report_progress())
+        try:
+            for round_no in range(1 + BROADCAST_RETRY_ROUNDS):
+                if round_no:
+                    await self._persist()
+                    if self.cancelled or not await run_db(count_retrying, self.job_id):
+                        break
+                    self._reset_recipients(await run_db(get_job, self.job_id))
+                workers = [asyncio.create_task(self._worker()) for _ in range(max(1, min(BROADCAST_CONCURRENCY, self.total)))]
+                await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            await self._persist()
+            active_jobs.pop(self.job_id, None)
+        await run_db(finish_job, self.job_id, JOB_CANCELLED if self.cancelled else JOB_DONE)
+        await self._edit_progress(await self.result_text())
+
+def _launch(bot, job, send_item):
+    broadcast_job = BroadcastJob(bot, job, send_item)
+    active_jobs[broadcast_job.job_id] = broadcast_job
+    broadcast_job.task = asyncio.create_task(broadcast_job.run())
+    return broadcast_job
+
+async def start_broadcast(bot, admin_id, kind, items, send_item, progress_chat_id, progress_message_id):
+    """创建并持久化广播任务，在后台运行，立即返回任务对象"""
+    job = await run_db(create_job, uuid.uuid4().hex[:12], admin_id, kind, items, progress_chat_id, progress_message_id)
+    return _launch(bot, job, send_item)
+
+async def resume_broadcasts(bot, send_items):
+    """重启后继续未完成的广播任务；send_items 为 {kind: send_item}"""
+    resumed = []
+    for job in await run_db(get_unfinished_jobs):
+        if job["job_id"] in active_jobs or job["kind"] not in send_items:
+            continue
+        logger.info("继续未完成的广播任务 %s（游标 %s）", job['job_id'], job['recipient_cursor'])
+        resumed.append(_launch(bot, job, send_items[job["kind"]]))
+    return resumed
+
+def get_active_jobs():
+    return list(active_jobs.values())
+
+async def stop_all_broadcasts():
+    """停机时中断所有任务，已完成的投递结果会先写入数据库，重启后继续"""
+    tasks = [job.task for job in get_active_jobs() if job.task]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import struct
+import signal
+import asyncio
+import logging
+from telegram import Bot, Update
+from bot.ratelimit import GLOBAL_RATE
+from bot.webhook import (
+    WebhookServer, serve, wait_for_stop_signal, register_webhook,
+    WEBHOOK_URL, WEBHOOK_PORT, WEBHOOK_DRAIN_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# 工作进程数；大于 1 时（仅 webhook 模式）由分发进程接收更新，按用户ID分发给各工作进程
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# 工作进程从分发进程接收更新的本地端口，依次为 BOT_WORKER_BASE_PORT + 编号
+BOT_WORKER_BASE_PORT = int(os.getenv("BOT_WORKER_BASE_PORT", str(WEBHOOK_PORT + 1)))
+# 当前工作进程编号，由分发进程设置；单进程运行时为 None
+WORKER_INDEX = int(os.environ["BOT_WORKER_INDEX"]) if os.getenv("BOT_WORKER_INDEX") else None
+# 等待工作进程启动完成的最长时间（秒）
+WORKER_START_TIMEOUT = 60
+
+# 分发进程与工作进程之间的帧：4 字节长度 + 更新 JSON
+FRAME_HEADER = struct.Struct("!I")
+
+def is_primary_worker():
+    """单进程运行或 0 号工作进程：负责只能有一份的后台任务（如继续未完成的广播）"""
+    return WORKER_INDEX in (None, 0)
+
+def owns_user(user_id):
+    """该用户的更新是否由当前进程处理（与分发进程的 routing_key % BOT_WORKERS 一致；单进程时总是）"""
+    return WORKER_INDEX is None or user_id % BOT_WORKERS == WORKER_INDEX
+
+def worker_port(index):
+    return BOT_WORKER_BASE_PORT + index
+
+def routing_key(data):
+    """更新的分发依据：发送者用户ID，没有时用聊天ID，都没有时用 update_id"""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return data.get("update_id", 0)
+
+class WorkerServer:
+    """工作进程端：读取分发进程发来的帧，解码后放入 application.update_queue"""
+
+    def __init__(self, application, port, listen="127.0.0.1"):
+        self.application = application
+        self.port = port
+        self.listen = listen
+        self._server = None
+        self._connections = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info("工作进程 %s 已监听 %s:%s", WORKER_INDEX, self.listen, self.port)
+
+    async def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """停止监听，等分发进程关闭连接（已发出的更新都已读取）后返回，超时则强制关闭"""
+        if self._server is not None:
+            self._server.close()
+        tasks = list(self._connections)
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                body = await reader.readexactly(length)
+                try:
+                    update = Update.de_json(json.loads(body), self.application.bot)
+                except Exception as e:
+                    logger.warning("工作进程收到无法解析的更新: %s", e)
+                    continue
+                await self.application.update_queue.put(update)
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+class DispatchServer(WebhookServer):
+    """分发进程端：接收 webhook 请求，不解码为 Update，按 routing_key 把原始 JSON 转发给对应工作进程"""
+
+    def __init__(self, ports, **kwargs):
+        super().__init__(None, **kwargs)
+        self.ports = ports
+        self._connections_to_workers = [None] * len(ports)  # [(reader, writer)]
+        self._locks = [asyncio.Lock() for _ in ports]
+
+    async def _enqueue(self, body):
+        try:
+            key = routing_key(json.loads(body))
+        except (ValueError, AttributeError) as e:
+            logger.warning("Webhook 收到无法解析的更新: %s", e)
+            return 400
+        index = key % len(self.ports)
+        try:
+            await self.forward(index, body)
+        except OSError as e:
+            # 返回错误码让 Telegram 稍后重发
+            logger.error("转发更新到工作进程 %s 失败: %s", index, e)
+            return 503
+        return 200
+
+    async def forward(self, index, body):
+        async with self._locks[index]:
+            connection = self._connections_to_workers[index]
+            # 工作进程重启后旧连接会收到 EOF，重新连接
+            if connection is None or connection[0].at_eof() or connection[1].is_closing():
+                connection = self._connections_to_workers[index] = await asyncio.open_connection("127.0.0.1", self.ports[index])
+            writer = connection[1]
+            writer.write(FRAME_HEADER.pack(len(body)) + body)
+            try:
+                await writer.drain()
+            except OSError:
+                self._connections_to_workers[index] = None
+                raise
+
+    async def wait_for_workers(self, timeout=WORKER_START_TIMEOUT):
+        """等待所有工作进程开始监听"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for index, port in enumerate(self.ports):
+            while True:
+                try:
+                    self._connections_to_workers[index] = await asyncio.open_connection("127.0.0.1", port)
+                    break
+                except OSError:
+                    if loop.time() > deadline:
+                        raise
+                    await asyncio.sleep(0.2)
+
+    async def close_workers(self):
+        """关闭到工作进程的连接，工作进程读完已发出的更新后即可退出"""
+        for index, connection in enumerate(self._connections_to_workers):
+            if connection is not None:
+                connection[1].close()
+                try:
+                    await connection[1].wait_closed()
+                except OSError:
+                    pass
+                self._connections_to_workers[index] = None
+
+class WorkerProcess:
+    """一个工作进程（python -m bot.main），意外退出时自动重启"""
+
+    def __init__(self, index, count):
+        self.index = index
+        self.env = dict(
+            os.environ,
+            BOT_WORKER_INDEX=str(index),
+            BOT_WORKERS=str(count),
+            BOT_WORKER_BASE_PORT=str(BOT_WORKER_BASE_PORT),
+            # Telegram 的发送频率限制按机器人计算，由各进程平分
+            TELEGRAM_GLOBAL_RATE=str(GLOBAL_RATE / count),
+        )
+        self.process = None
+        self.stopping = False
+
+    async def supervise(self):
+        while not self.stopping:
+            self.process = await asyncio.create_subprocess_exec(sys.executable, "-m", "bot.main", env=self.env)
+            code = await self.process.wait()
+            if not self.stopping:
+                logger.error("工作进程 %s 意外退出（%s），1 秒后重启", self.index, code)
+                await asyncio.sleep(1)
+
+    async def stop(self, timeout):
+        self.stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            self.process.send_signal(signal.SIGTERM)
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            logger.warning("工作进程 %s 未能按时退出，强制结束", self.index)
+            self.process.kill()
+            await self.process.wait()
+
+async def serve_dispatcher(token, count=BOT_WORKERS):
+    """启动 count 个工作进程，接收 webhook 并按用户分发；停机时先停止接收，再让工作进程处理完剩余更新后退出"""
+    workers = [WorkerProcess(index, count) for index in range(count)]
+    supervisors = [asyncio.create_task(worker.supervise()) for worker in workers]
+    server = DispatchServer([worker_port(index) for index in range(count)])
+    try:
+        await server.wait_for_workers()
+        await server.start()
+        if WEBHOOK_URL:
+            async with Bot(token) as bot:
+                await register_webhook(bot)
+        logger.info("分发进程已启动，%s 个工作进程", count)
+        await wait_for_stop_signal()
+    finally:
+        logger.info("正在停止分发进程，等待进行中的请求完成...")
+        await server.stop()
+        await server.close_workers()
+        await asyncio.gather(*(worker.stop(WEBHOOK_DRAIN_TIMEOUT * 3) for worker in workers))
+        await asyncio.gather(*supervisors, return_exceptions=True)
+
+def run_dispatcher(token):
+    asyncio.run(serve_dispatcher(token))
+
+def run_worker(application):
+    asyncio.run(serve(application, WorkerServer(application, worker_port(WORKER_INDEX))))
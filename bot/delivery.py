@@ -0,0 +1,109 @@
+import os
+import asyncio
+import inspect
+import logging
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from bot.ratelimit import call_with_retry, global_limiter, TokenBucket, PER_CHAT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# 同一目标（频道/管理员）同时进行的发送数上限
+PER_DESTINATION_CONCURRENCY = int(os.getenv("PER_DESTINATION_CONCURRENCY", "1"))
+
+# 单个目标的投递结果：ok 为 False 时 error 为异常对象
+DeliveryResult = namedtuple('DeliveryResult', ['destination', 'ok', 'result', 'error'])
+
+_destination_semaphores = {}
+_background_tasks = set()
+_chat_queues = {}
+
+class RateLimitedBot:
+    """Bot 代理：所有 Bot API 协程调用都经过全局限速器，并在 RetryAfter/网络错误时重试"""
+
+    def __init__(self, bot, limiter=global_limiter):
+        self._bot = bot
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._bot, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        async def limited(*args, **kwargs):
+            return await call_with_retry(attr, *args, limiter=self._limiter, **kwargs)
+        return limited
+
+def _semaphore(destination):
+    sem = _destination_semaphores.get(destination)
+    if sem is None:
+        sem = _destination_semaphores[destination] = asyncio.Semaphore(PER_DESTINATION_CONCURRENCY)
+    return sem
+
+async def fan_out(destinations, send):
+    """
+    并发向多个目标投递，send(destination) 为协程函数。
+    单个目标失败不影响其他目标，按 destinations 顺序返回 DeliveryResult 列表。
+    """
+    async def deliver(destination):
+        async with _semaphore(destination):
+            try:
+                return DeliveryResult(destination, True, await send(destination), None)
+            except Exception as e:
+                logger.warning("投递到 %s 失败: %s", destination, e)
+                return DeliveryResult(destination, False, None, e)
+    return list(await asyncio.gather(*(deliver(d) for d in destinations)))
+
+class ChatQueue:
+    """单个聊天的发送队列：按聊天限速，该聊天的 RetryAfter 只暂停这个聊天，同时仍受全局限速"""
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.lock = asyncio.Lock()
+        rate = 1 / PER_CHAT_INTERVAL if PER_CHAT_INTERVAL > 0 else global_limiter.target_rate
+        self.limiter = TokenBucket(rate, capacity=1, min_rate=rate / 4)
+        self.users = 0
+
+    async def send(self, func, *args, **kwargs):
+        """调用一次 Bot API，遇到 RetryAfter/网络错误时按 call_with_retry 的规则重试"""
+        async def call(*a, **kw):
+            await global_limiter.acquire()
+            return await func(*a, **kw)
+        return await call_with_retry(call, *args, limiter=self.limiter, **kwargs)
+
+@asynccontextmanager
+async def chat_queue(chat_id):
+    """
+    独占某个聊天的发送队列：同一聊天的多次投递按到达顺序排队、互不穿插。
+    用法：async with chat_queue(chat_id) as queue: await queue.send(bot.send_message, chat_id, text)
+    """
+    queue = _chat_queues.get(chat_id)
+    if queue is None:
+        queue = _chat_queues[chat_id] = ChatQueue(chat_id)
+    queue.users += 1
+    try:
+        async with queue.lock:
+            yield queue
+    finally:
+        queue.users -= 1
+        _prune_chat_queues()
+
+def _prune_chat_queues():
+    """丢弃无人使用且限速已恢复的队列，避免按用户无限增长"""
+    for chat_id in [c for c, q in _chat_queues.items() if not q.users and q.limiter.idle()]:
+        del _chat_queues[chat_id]
+
+def delivery_stats():
+    return {"chat_queues": len(_chat_queues), "background_tasks": len(_background_tasks)}
+
+def spawn(coro):
+    """在后台运行协程并保留引用，停机时由 drain_background_tasks 等待完成"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def drain_background_tasks(timeout=30):
+    """停机前等待后台投递完成"""
+    if _background_tasks:
+        await asyncio.wait(list(_background_tasks), timeout=timeout)
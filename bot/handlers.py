@@ -1,211 +1,142 @@
 import os
 import asyncio
+import logging
 from collections import defaultdict
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from backend.utils import save_group_to_channel, store_group_mapping, get_group_by_id, generate_link, generate_group_id
+from backend.utils import save_group_to_channel, store_group_mapping, get_group, generate_link, get_group_cache_stats, find_existing_group, get_group_stats
+from backend.db import run_db
+from backend.config import get_config, set_config_value
+from backend.sessions import StateStore
+from backend.users import upsert_user, touch_user, get_all_users, count_users, get_user_stats, record_follow, get_follow_stats, reset_follow_stats
+from backend.broadcasts import get_recent_jobs, get_unfinished_jobs, request_cancel
+from backend.cache import LRUCache
+from bot.broadcast import start_broadcast, active_jobs
+from bot.cluster import owns_user
+from bot.delivery import RateLimitedBot, fan_out, spawn, chat_queue
+from bot.instrumentation import FUNCTION_DURATION
+from backend.metrics import timed
+from backend.profiler import start_profiling, stop_profiling, collect_report, get_active_session, PROFILE_SLOW_CALLBACK, PROFILE_MAX_DURATION
 import json
-from datetime import datetime
-INTRO_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'intro.txt')
 from telegram import InputMediaPhoto, InputMediaVideo
 import uuid
-BIND_CHANNELS_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'bind_channels.json')
-FORCE_FOLLOW_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'force_follow.json')
-FOLLOW_STATS_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'follow_stats.json')
-USERS_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'users.json')
-BROADCAST_HISTORY_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'broadcast_history.json')
-
-# 用户管理功能
-def get_users():
+
+logger = logging.getLogger(__name__)
+
+# 用户管理功能（存储于 mapping.db 的 User 表）
+async def get_users():
     """获取所有用户列表"""
-    if os.path.exists(USERS_PATH):
-        with open(USERS_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+    return await run_db(get_all_users)
 
 def add_user(user_id, username=None, first_name=None, last_name=None):
     """添加用户到数据库"""
-    users = get_users()
-    user_info = {
-        "user_id": user_id,
-        "username": username,
-        "first_name": first_name,
-        "last_name": last_name,
-        "joined_at": datetime.now().isoformat(),
-        "last_active": datetime.now().isoformat()
-    }
-    
-    # 检查用户是否已存在
-    existing_user = next((user for user in users if user["user_id"] == user_id), None)
-    if existing_user:
-        # 更新用户信息
-        existing_user.update(user_info)
-    else:
-        # 添加新用户
-        users.append(user_info)
-    
-    with open(USERS_PATH, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+    upsert_user(user_id, username=username, first_name=first_name, last_name=last_name)
 
 def update_user_activity(user_id):
     """更新用户最后活跃时间"""
-    users = get_users()
-    for user in users:
-        if user["user_id"] == user_id:
-            user["last_active"] = datetime.now().isoformat()
-            break
-    
-    with open(USERS_PATH, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
-
-def get_broadcast_history():
-    """获取广播历史"""
-    if os.path.exists(BROADCAST_HISTORY_PATH):
-        with open(BROADCAST_HISTORY_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
-
-def save_broadcast_history(broadcast_info):
-    """保存广播历史"""
-    history = get_broadcast_history()
-    history.append(broadcast_info)
-    
-    # 只保留最近50条记录
-    if len(history) > 50:
-        history = history[-50:]
-    
-    with open(BROADCAST_HISTORY_PATH, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
-
-# 广播缓冲区
-broadcast_buffers = defaultdict(list)
+    touch_user(user_id)
+
+async def get_broadcast_history(limit=50):
+    """获取广播历史（按时间正序，来自 BroadcastJob 表）"""
+    history = []
+    for job in reversed(await run_db(get_recent_jobs, limit)):
+        history.append({
+            "job_id": job["job_id"],
+            "timestamp": job["created_at"] or "",
+            "admin_id": job["admin_id"],
+            "type": job["kind"],
+            "status": job["status"],
+            "total_users": job["total"],
+            "success_count": job["success_count"],
+            "failed_count": job["failed_count"]
+        })
+    return history
+
+# 审核队列、管理员输入状态和草稿的保留时间（秒）
+PENDING_SUBMISSION_TTL = float(os.getenv("PENDING_SUBMISSION_TTL", str(7 * 24 * 3600)))
+ADMIN_INPUT_TTL = float(os.getenv("ADMIN_INPUT_TTL", str(24 * 3600)))
+DRAFT_TTL = float(os.getenv("DRAFT_TTL", str(24 * 3600)))
+# 每个用户草稿最多条数；所有草稿合计占用上限（字节，按序列化后的长度估算），超出时淘汰最久未更新的草稿
+DRAFT_MAX_ITEMS = int(os.getenv("DRAFT_MAX_ITEMS", "100"))
+DRAFT_MEMORY_BUDGET = int(os.getenv("DRAFT_MEMORY_BUDGET", str(32 * 1024 * 1024)))
+
+# 广播缓冲区 {admin_id: [序列化内容]}
+broadcast_buffers = StateStore('broadcast_buffers', ttl=ADMIN_INPUT_TTL, key_type=int, owns=owns_user)
+# 正在接收的广播相册 {admin_id: {'media': [序列化内容], 'timer', 'last_group_id'}}，相册收齐后移除
 broadcast_media_group_buffers = defaultdict(lambda: {'media': [], 'timer': None, 'last_group_id': None})
 
-# 广播模式状态管理
-broadcast_mode_users = set()  # 记录哪些用户在广播模式中
+# 广播模式状态管理 {admin_id: True}，记录哪些管理员在广播模式中
+broadcast_mode_users = StateStore('broadcast_mode', ttl=ADMIN_INPUT_TTL, key_type=int, owns=owns_user)
 
-# 通知缓存
-notification_cache = {}  # {user_id: notification_text}
+# 待确认的系统通知 {admin_id: notification_text}
+notification_cache = StateStore('notification_drafts', ttl=ADMIN_INPUT_TTL, key_type=int, owns=owns_user)
 
+# 配置读取都来自 get_config() 的不可变快照，修改通过 set_config_value 写入并替换快照
 def add_bound_channel(channel_id):
     channels = get_bound_channels()
     if channel_id not in channels:
-        channels.append(channel_id)
-        with open(BIND_CHANNELS_PATH, 'w', encoding='utf-8') as f:
-            json.dump(channels, f)
+        set_config_value("bind_channels", list(channels) + [channel_id])
 
 def remove_bound_channel(channel_id):
     channels = get_bound_channels()
     if channel_id in channels:
-        channels.remove(channel_id)
-        with open(BIND_CHANNELS_PATH, 'w', encoding='utf-8') as f:
-            json.dump(channels, f)
+        set_config_value("bind_channels", [c for c in channels if c != channel_id])
 
 def get_bound_channels():
-    if os.path.exists(BIND_CHANNELS_PATH):
-        with open(BIND_CHANNELS_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    # 兼容老逻辑，首次用.env
-    env_id = os.getenv("CHANNEL_ID")
-    return [env_id] if env_id else []
+    return get_config().bound_channels
 
 def get_force_follow_config():
-    if os.path.exists(FORCE_FOLLOW_PATH):
-        with open(FORCE_FOLLOW_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {"enabled": False, "channel_id": "", "channel_username": ""}
+    """只读配置，修改时先 dict(...) 复制再 save_force_follow_config"""
+    return get_config().force_follow
 
 def save_force_follow_config(config):
-    with open(FORCE_FOLLOW_PATH, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=2)
-
-async def check_user_in_channel(bot, user_id, channel_id):
-    """检查用户是否在指定频道中"""
+    set_config_value("force_follow", dict(config))
+
+# 强制关注检查结果缓存：{(user_id, channel_id): 是否已关注}，已关注/未关注分别设置过期时间
+MEMBERSHIP_POSITIVE_TTL = float(os.getenv("MEMBERSHIP_POSITIVE_TTL", "600"))
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "30"))
+membership_cache = LRUCache(maxsize=int(os.getenv("MEMBERSHIP_CACHE_SIZE", "50000")))
+
+async def check_user_in_channel(bot, user_id, channel_id, trust_negative=True):
+    """检查用户是否在指定频道中；trust_negative 为 False 时忽略缓存中的“未关注”结果（用于重新检查）"""
+    key = (user_id, str(channel_id))
+    # 重新检查时不采用缓存的“未关注”结果，不计为命中
+    cached = membership_cache.get(key, accept=lambda is_member: is_member or trust_negative)
+    if cached is not None:
+        return cached
     try:
         member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-        return member.status in ['member', 'administrator', 'creator']
+        is_member = member.status in ['member', 'administrator', 'creator']
     except Exception as e:
-        print(f"检查用户频道状态失败: {e}")
+        logger.warning("检查用户 %s 频道状态失败: %s", user_id, e)
         return False
-
-def get_follow_stats():
-    """获取关注统计数据"""
-    if os.path.exists(FOLLOW_STATS_PATH):
-        with open(FOLLOW_STATS_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {"total_follows": 0, "today_follows": 0, "last_reset_date": "", "follow_records": []}
-
-def save_follow_stats(stats):
-    """保存关注统计数据"""
-    with open(FOLLOW_STATS_PATH, 'w', encoding='utf-8') as f:
-        json.dump(stats, f, ensure_ascii=False, indent=2)
-
-def record_follow(user_id, username=None):
-    """记录用户关注"""
-    stats = get_follow_stats()
-    today = datetime.now().strftime("%Y-%m-%d")
-    
-    # 检查是否今天第一次重置
-    if stats["last_reset_date"] != today:
-        stats["today_follows"] = 0
-        stats["last_reset_date"] = today
-    
-    # 检查用户是否已经记录过
-    user_record = {
-        "user_id": user_id,
-        "username": username,
-        "timestamp": datetime.now().isoformat()
-    }
-    
-    # 检查是否是新用户
-    existing_user = any(record["user_id"] == user_id for record in stats["follow_records"])
-    if not existing_user:
-        stats["total_follows"] += 1
-        stats["today_follows"] += 1
-        stats["follow_records"].append(user_record)
-        save_follow_stats(stats)
-        return True
-    return False
+    membership_cache.set(key, is_member, ttl=MEMBERSHIP_POSITIVE_TTL if is_member else MEMBERSHIP_NEGATIVE_TTL)
+    return is_member
 
 # 读取介绍内容
 def get_intro():
-    if os.path.exists(INTRO_PATH):
-        with open(INTRO_PATH, 'r', encoding='utf-8') as f:
-            return f.read().strip()
-    return '这是一个资源管理机器人，支持任意内容合并分享。'
+    return get_config().intro
 
 # 保存介绍内容
 def set_intro(text):
-    with open(INTRO_PATH, 'w', encoding='utf-8') as f:
-        f.write(text.strip())
-
-user_buffers = defaultdict(list)
-user_media_group_buffers = defaultdict(lambda: {'media': [], 'timer': None, 'last_group_id': None})
+    set_config_value("intro", text.strip())
 
-ADMIN_IDS_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'admin_ids.json')
+# 用户草稿 {user_id: [序列化内容]}，相册中的条目带 media_group_id，点击完成时合并
+user_buffers = StateStore('drafts', ttl=DRAFT_TTL, key_type=int, max_bytes=DRAFT_MEMORY_BUDGET, owns=owns_user)
+# 正在接收的相册 {user_id: {'media': [草稿条目], 'timer', 'last_group_id', 'dropped'}}，相册收齐后移除
+user_media_group_buffers = defaultdict(lambda: {'media': [], 'timer': None, 'last_group_id': None, 'dropped': 0})
 
-# 初始化管理员ID列表，默认包含 7389854735
-DEFAULT_ADMINS = [7389854735]
+# 管理员ID集合（frozenset），未配置时默认包含 7389854735
 def load_admin_ids():
-    if os.path.exists(ADMIN_IDS_PATH):
-        with open(ADMIN_IDS_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return DEFAULT_ADMINS.copy()
+    return get_config().admin_ids
 def save_admin_ids(ids):
-    with open(ADMIN_IDS_PATH, 'w', encoding='utf-8') as f:
-        json.dump(ids, f)
-
-BIND_CHANNEL_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'bind_channel.txt')
+    set_config_value("admin_ids", sorted(ids))
 
 def set_bound_channel(channel_id):
-    with open(BIND_CHANNEL_PATH, 'w', encoding='utf-8') as f:
-        f.write(str(channel_id))
+    set_config_value("bind_channel", str(channel_id))
 
 def get_bound_channel():
-    if os.path.exists(BIND_CHANNEL_PATH):
-        with open(BIND_CHANNEL_PATH, 'r', encoding='utf-8') as f:
-            return f.read().strip()
-    return os.getenv("CHANNEL_ID")
+    return get_config().bound_channel
 
 async def bindchannel_handler(update, context):
     user_id = update.effective_user.id
@@ -235,7 +166,7 @@ async def start_handler(update: Update, context):
     
     # 移除主菜单按钮
     if payload:
-        group = get_group_by_id(payload)
+        group = await get_group(payload)
         if group:
             # 检查强制关注设置
             force_config = get_force_follow_config()
@@ -266,14 +197,14 @@ async def start_handler(update: Update, context):
             await update.message.reply_text("资源未找到或链接已失效。")
     else:
         await update.message.reply_text(
-            f"欢迎！请发送任意内容，发送多条后点击下方"完成"按钮，我会帮你生成访问链接并备份到频道。\n\n{get_intro()}"
+            f"欢迎！请发送任意内容，发送多条后点击下方“完成”按钮，我会帮你生成访问链接并备份到频道。\n\n{get_intro()}"
         )
 
 async def help_handler(update: Update, context):
     help_text = (
         "【功能说明】\n"
         "- 支持任意内容（文本、图片、视频等）发送给机器人，生成唯一访问链接\n"
-        "- 多条内容合并为一个链接，点击"完成"后生成\n"
+        "- 多条内容合并为一个链接，点击“完成”后生成\n"
         "- 所有内容自动备份到频道\n"
         "- 链接可分享，其他用户点击后机器人自动发送原内容\n"
         "\n【指令列表】\n"
@@ -281,7 +212,7 @@ async def help_handler(update: Update, context):
         "/help - 显示帮助和功能说明\n"
         "/intro - 查看机器人介绍\n"
         "/setintro <内容> - 设置机器人介绍（仅管理员）\n"
-        "发送内容+点击"完成" - 生成合并内容的访问链接"
+        "发送内容+点击“完成” - 生成合并内容的访问链接"
     )
     await update.message.reply_text(help_text)
 
@@ -313,8 +244,7 @@ async def addadmin_handler(update: Update, context):
     new_admin = int(context.args[0])
     if new_admin in admin_ids:
         await update.message.reply_text("该用户已是管理员。"); return
-    admin_ids.append(new_admin)
-    save_admin_ids(admin_ids)
+    save_admin_ids(admin_ids | {new_admin})
     await update.message.reply_text(f"已添加管理员：{new_admin}")
 
 async def deladmin_handler(update: Update, context):
@@ -329,8 +259,7 @@ async def deladmin_handler(update: Update, context):
         await update.message.reply_text("该用户不是管理员。"); return
     if del_admin == user_id:
         await update.message.reply_text("不能删除自己。"); return
-    admin_ids.remove(del_admin)
-    save_admin_ids(admin_ids)
+    save_admin_ids(admin_ids - {del_admin})
     await update.message.reply_text(f"已移除管理员：{del_admin}")
 
 async def button_handler(update: Update, context):
@@ -354,6 +283,7 @@ async def button_handler(update: Update, context):
             del rejection_reason_states[user_id]
             
             # 获取投稿信息
+            await pending_submissions.refresh(submission_id)
             submission = pending_submissions.get(submission_id, None)
             if submission:
                 # 返回到审核界面
@@ -434,6 +364,7 @@ async def button_handler(update: Update, context):
             del tag_input_states[user_id]
             
             # 获取投稿信息
+            await pending_submissions.refresh(submission_id)
             submission = pending_submissions.get(submission_id, None)
             if submission:
                 # 返回到审核界面
@@ -486,6 +417,7 @@ async def button_handler(update: Update, context):
         submission_id = query.data.split('_', 2)[2]
         
         # 获取投稿信息
+        await pending_submissions.refresh(submission_id)
         submission = pending_submissions.get(submission_id, None)
         if not submission:
             await query.answer("❌ 该投稿已被处理或已过期。", show_alert=True)
@@ -494,6 +426,7 @@ async def button_handler(update: Update, context):
         # 移除标签
         if 'tags' in submission:
             removed_tags = submission.pop('tags', [])
+            pending_submissions.save(submission_id)
             tags_text = ' '.join(removed_tags) if removed_tags else "无"
         else:
             tags_text = "无"
@@ -540,19 +473,19 @@ async def button_handler(update: Update, context):
     elif query.data.startswith("check_follow_"):
         # 处理重新检查关注状态
         payload = query.data.replace("check_follow_", "")
-        group = get_group_by_id(payload)
+        group = await get_group(payload)
         if group:
             force_config = get_force_follow_config()
             if force_config["enabled"] and force_config["channel_id"]:
                 user_id = query.from_user.id
-                is_member = await check_user_in_channel(context.bot, user_id, force_config["channel_id"])
+                is_member = await check_user_in_channel(context.bot, user_id, force_config["channel_id"], trust_negative=False)
                 
                 if is_member:
                     # 已关注，发送内容
                     # 记录关注统计
                     user = await context.bot.get_chat(query.from_user.id)
                     username = user.username if hasattr(user, 'username') and user.username else None
-                    is_new_follow = record_follow(query.from_user.id, username)
+                    await run_db(record_follow, query.from_user.id, username)
                     
                     await restore_group_to_user(group, context.bot, query.message.chat_id)
                     await query.edit_message_text("✅ 内容已发送！")
@@ -573,33 +506,28 @@ async def content_handler(update: Update, context):
         user_id = update.effective_user.id
         admin_ids = load_admin_ids()
         
-        # 添加调试信息
-        print(f"🔍 content_handler 被调用 - 用户ID: {user_id}")
-        print(f"🔍 管理员列表: {admin_ids}")
-        print(f"🔍 广播模式用户: {broadcast_mode_users}")
-        print(f"🔍 用户是管理员: {user_id in admin_ids}")
-        print(f"🔍 用户在广播模式: {user_id in broadcast_mode_users}")
+        logger.debug("content_handler 被调用 - 用户ID: %s，是否管理员: %s", user_id, user_id in admin_ids)
         
         # 检查是否是管理员且在广播模式中
         if user_id in admin_ids and user_id in broadcast_mode_users:
-            print(f"🔍 管理员在广播模式中，处理广播内容")
+            logger.debug("管理员 %s 在广播模式中，处理广播内容", user_id)
             # 处理广播内容
             await handle_broadcast_content(update, context)
             return
         
         # 检查是否是管理员在输入拒绝原因
         if user_id in admin_ids and user_id in rejection_reason_states and rejection_reason_states[user_id].get('waiting_for_reason'):
-            print(f"🔍 管理员在输入拒绝原因")
+            logger.debug("管理员 %s 在输入拒绝原因", user_id)
             await handle_rejection_reason(update, context)
             return
         
         # 检查是否是管理员在输入标签
         if user_id in admin_ids and user_id in tag_input_states and tag_input_states[user_id].get('waiting_for_tags'):
-            print(f"🔍 管理员在输入标签")
+            logger.debug("管理员 %s 在输入标签", user_id)
             await handle_tag_input(update, context)
             return
         
-        print(f"🔍 content_handler 开始处理普通内容")
+        logger.debug("content_handler 开始处理普通内容 - 用户ID: %s", user_id)
         
         # 记录用户信息（确保所有用户都被记录）
         user = update.effective_user
@@ -612,17 +540,24 @@ async def content_handler(update: Update, context):
         
         message = update.message
         media_group_id = getattr(message, 'media_group_id', None)
+        draft_size = len(user_buffers.get(user_id, []))
         if media_group_id:
-            # 收集media group
+            # 收集media group，超出条数上限的部分丢弃，收齐后统一提示
             buf = user_media_group_buffers[user_id]
-            buf['media'].append(update)
+            if draft_size + len(buf['media']) < DRAFT_MAX_ITEMS:
+                buf['media'].append(serialize_draft_message(message))
+            else:
+                buf['dropped'] += 1
             buf['last_group_id'] = media_group_id
             # 重置等待定时器
             if buf['timer']:
                 buf['timer'].cancel()
             buf['timer'] = asyncio.create_task(media_group_wait_and_confirm(user_id, context))
         else:
-            user_buffers[user_id].append(update)
+            if draft_size >= DRAFT_MAX_ITEMS:
+                await update.message.reply_text(f"每次最多提交 {DRAFT_MAX_ITEMS} 条内容，请先点击完成或取消。")
+                return
+            add_draft_items(user_id, [serialize_draft_message(message)])
             keyboard = InlineKeyboardMarkup([
                 [
                     InlineKeyboardButton("完成", callback_data="finish_signed"),
@@ -632,7 +567,7 @@ async def content_handler(update: Update, context):
             ])
             await update.message.reply_text("已收到，继续发送或点击完成。", reply_markup=keyboard)
     except Exception as e:
-        print(f"content_handler 错误: {e}")
+        logger.exception("content_handler 错误: %s", e)
         # 发送错误提示给用户
         try:
             await update.message.reply_text("处理消息时出现错误，请重试。")
@@ -659,7 +594,7 @@ async def handle_broadcast_content(update: Update, context):
         if media_group_id:
             # 收集media group
             buf = broadcast_media_group_buffers[user_id]
-            buf['media'].append(update)
+            buf['media'].append(serialize_message(message))
             buf['last_group_id'] = media_group_id
             # 重置等待定时器
             if buf['timer']:
@@ -670,7 +605,7 @@ async def handle_broadcast_content(update: Update, context):
             broadcast_buffers[user_id] = [serialize_message(message)]
             
             # 获取用户数量
-            users = get_users()
+            user_count = await run_db(count_users)
             
             # 显示确认界面
             keyboard = InlineKeyboardMarkup([
@@ -699,29 +634,61 @@ async def handle_broadcast_content(update: Update, context):
             message_text = f"📢 广播确认\n\n"
             message_text += f"内容类型：{content_type}\n"
             message_text += f"内容预览：{preview_text}\n"
-            message_text += f"发送给：{len(users)} 个用户\n\n"
+            message_text += f"发送给：{user_count} 个用户\n\n"
             message_text += "⚠️ 此操作不可撤销，请确认！"
             
             await update.message.reply_text(message_text, reply_markup=keyboard)
             
             # 退出广播模式
-            broadcast_mode_users.discard(user_id)
-            print(f"🔍 已退出广播模式，用户ID: {user_id}")
+            broadcast_mode_users.pop(user_id, None)
+            logger.debug("已退出广播模式，用户ID: %s", user_id)
             
     except Exception as e:
-        print(f"handle_broadcast_content 错误: {e}")
+        logger.exception("handle_broadcast_content 错误: %s", e)
         # 发送错误提示给用户
         try:
             await update.message.reply_text("处理广播内容时出现错误，请重试。")
         except:
             pass
 
+def serialize_draft_message(message):
+    """草稿条目：序列化内容，相册中的消息额外记录 media_group_id"""
+    item = serialize_message(message)
+    media_group_id = getattr(message, 'media_group_id', None)
+    if media_group_id:
+        item['media_group_id'] = media_group_id
+    return item
+
+def add_draft_items(user_id, items):
+    draft = user_buffers.get(user_id, [])
+    draft.extend(items)
+    user_buffers[user_id] = draft
+
+def group_draft_items(draft):
+    """把草稿中连续且 media_group_id 相同的条目合并为 media_group"""
+    grouped = []
+    for item in draft:
+        item = dict(item)
+        media_group_id = item.pop('media_group_id', None)
+        if media_group_id and grouped and grouped[-1].get('media_group_id') == media_group_id:
+            grouped[-1]['items'].append(item)
+        elif media_group_id:
+            grouped.append({'type': 'media_group', 'media_group_id': media_group_id, 'items': [item]})
+        else:
+            grouped.append(item)
+    for item in grouped:
+        item.pop('media_group_id', None)
+    return grouped
+
 async def media_group_wait_and_confirm(user_id, context):
     await asyncio.sleep(2.5)  # 等待2.5秒，判断用户是否还在发
-    buf = user_media_group_buffers[user_id]
-    user_buffers[user_id].extend(buf['media'])
-    buf['media'].clear()
-    buf['timer'] = None
+    buf = user_media_group_buffers.pop(user_id, None)
+    if not buf:
+        return
+    add_draft_items(user_id, buf['media'])
+    text = "已收到，继续发送或点击完成。"
+    if buf['dropped']:
+        text = f"已达到 {DRAFT_MAX_ITEMS} 条上限，{buf['dropped']} 个文件未收录。请点击完成或取消。"
     keyboard = InlineKeyboardMarkup([
         [
             InlineKeyboardButton("完成", callback_data="finish_signed"),
@@ -730,8 +697,7 @@ async def media_group_wait_and_confirm(user_id, context):
         ]
     ])
     # 只回复一次
-    last_update = user_buffers[user_id][-1]
-    await last_update.message.reply_text("已收到，继续发送或点击完成。", reply_markup=keyboard)
+    await context.bot.send_message(chat_id=user_id, text=text, reply_markup=keyboard)
 
 def format_user_signature(user):
     """格式化用户署名"""
@@ -763,114 +729,142 @@ async def get_channel_username(bot, channel_id):
         channel_id_to_username[channel_id] = username
     return username
 
-# 修改send_group_to_channel支持多频道
+async def send_existing_group_link(bot, chat_id, existing):
+    """发送已存在内容组的链接，知道所在频道消息时附带“查看”按钮"""
+    link = generate_link(existing['group_id'])
+    if link.startswith("⚠️"):
+        await bot.send_message(chat_id=chat_id, text=link)
+        return
+    buttons = [[InlineKeyboardButton("点击访问内容", url=link)]]
+    if existing['channel_id'] and existing['channel_msg_id']:
+        try:
+            channel_username = await get_channel_username(bot, int(existing['channel_id']))
+        except Exception as e:
+            logger.warning("获取频道 %s 用户名失败: %s", existing['channel_id'], e)
+            channel_username = None
+        if channel_username:
+            buttons.append([InlineKeyboardButton("查看", url=f"https://t.me/{channel_username}/{existing['channel_msg_id']}")])
+    await bot.send_message(chat_id=chat_id, text=f"🔗 链接 👇\n{link}", reply_markup=InlineKeyboardMarkup(buttons))
+
+def build_caption(text, is_anonymous=False, user=None, tags=None):
+    """在正文/说明后追加署名和标签"""
+    if not is_anonymous and user:
+        signature = format_user_signature(user)
+        if signature:
+            text = f"{text}\n\n{signature}" if text else signature
+    if tags:
+        tags_text = ' '.join(tags)
+        text = f"{text}\n\n{tags_text}" if text else tags_text
+    return text
+
+async def replicate_to_channel(bot, from_chat_id, channel_id, plan, is_anonymous=False, user=None, tags=None):
+    """
+    把主频道已发布的消息复制到其他频道，不再重新拼装内容。
+    支持 copy_messages 的版本按批复制；否则单条消息用 copy_message，
+    媒体组用主频道发布时构造好的 InputMedia 原样重发（保持相册形式）。
+    主频道未发布的类型单独发送，附带与主频道相同的署名和标签。
+    """
+    if hasattr(bot, 'copy_messages'):
+        message_ids = []
+        for entry in plan:
+            if 'item' in entry:
+                if message_ids:
+                    await bot.copy_messages(channel_id, from_chat_id, message_ids)
+                    message_ids = []
+                await send_item_to_chat(entry['item'], bot, channel_id, is_anonymous=is_anonymous, user=user, tags=tags)
+            else:
+                message_ids.extend(entry['message_ids'])
+        for start in range(0, len(message_ids), 100):
+            await bot.copy_messages(channel_id, from_chat_id, message_ids[start:start + 100])
+        return
+    for entry in plan:
+        if 'item' in entry:
+            await send_item_to_chat(entry['item'], bot, channel_id, is_anonymous=is_anonymous, user=user, tags=tags)
+        elif entry.get('media'):
+            await bot.send_media_group(channel_id, entry['media'])
+        else:
+            for message_id in entry['message_ids']:
+                await bot.copy_message(channel_id, from_chat_id, message_id)
+
+# 修改send_group_to_channel支持多频道：主频道发布一次，其他频道复制主频道的消息
+@timed(FUNCTION_DURATION, "send_group_to_channel")
 async def send_group_to_channel(grouped, bot, is_anonymous=False, user=None, tags=None):
+    bot = RateLimitedBot(bot)
     channel_ids = get_bound_channels()
     first_channel_msg_id = None
     first_channel_username = None
     first_channel_id = channel_ids[0] if channel_ids else None
+    # 复制计划：[{'message_ids': [...], 'media': [...]}] 或 [{'item': item}]（主频道未发布的类型）
+    plan = []
     # 只处理第一个绑定频道，获取所有消息的最后一条 message_id
     if first_channel_id:
+        chat_id = int(first_channel_id)
         for idx, item in enumerate(grouped):
-            msg = None
+            msgs = None
+            media = None
             if item['type'] == 'media_group':
                 media = []
-                from telegram import InputMediaPhoto, InputMediaVideo
+                last = len(item['items']) - 1
                 for i, m in enumerate(item['items']):
                     caption = m.get('caption') or ""
-                    if not is_anonymous and user and i == len(item['items']) - 1:
-                        signature = format_user_signature(user)
-                        if signature:
-                            caption = f"{caption}\n\n{signature}" if caption else signature
-                    if tags and i == len(item['items']) - 1:
-                        tags_text = ' '.join(tags)
-                        caption = f"{caption}\n\n{tags_text}" if caption else tags_text
+                    if i == last:
+                        caption = build_caption(caption, is_anonymous, user, tags)
                     if m['type'] == 'photo':
                         media.append(InputMediaPhoto(media=m['file_id'], caption=caption))
                     elif m['type'] == 'video':
                         media.append(InputMediaVideo(media=m['file_id'], caption=caption))
                 if media:
-                    msgs = await bot.send_media_group(int(first_channel_id), media)
-                    msg = msgs[-1]  # 取最后一条
-            elif item['type'] == 'photo':
-                caption = item.get('caption') or ''
-                if not is_anonymous and user:
-                    signature = format_user_signature(user)
-                    if signature:
-                        caption = f"{caption}\n\n{signature}" if caption else signature
-                if tags:
-                    tags_text = ' '.join(tags)
-                    caption = f"{caption}\n\n{tags_text}" if caption else tags_text
-                msg = await bot.send_photo(int(first_channel_id), item['file_id'], caption=caption if caption else None)
-            elif item['type'] == 'video':
-                caption = item.get('caption') or ''
-                if not is_anonymous and user:
-                    signature = format_user_signature(user)
-                    if signature:
-                        caption = f"{caption}\n\n{signature}" if caption else signature
-                if tags:
-                    tags_text = ' '.join(tags)
-                    caption = f"{caption}\n\n{tags_text}" if caption else tags_text
-                msg = await bot.send_video(int(first_channel_id), item['file_id'], caption=caption if caption else None)
+                    msgs = await bot.send_media_group(chat_id, media)
             elif item['type'] == 'text':
-                text = item['text']
-                if not is_anonymous and user:
-                    signature = format_user_signature(user)
-                    if signature:
-                        text = f"{text}\n\n{signature}"
-                if tags:
-                    tags_text = ' '.join(tags)
-                    text = f"{text}\n\n{tags_text}"
-                msg = await bot.send_message(int(first_channel_id), text)
-            elif item['type'] == 'document':
-                caption = item.get('caption') or ''
-                if not is_anonymous and user:
-                    signature = format_user_signature(user)
-                    if signature:
-                        caption = f"{caption}\n\n{signature}" if caption else signature
-                if tags:
-                    tags_text = ' '.join(tags)
-                    caption = f"{caption}\n\n{tags_text}" if caption else tags_text
-                msg = await bot.send_document(int(first_channel_id), item['file_id'], caption=caption if caption else None, filename=item.get('file_name'))
-            elif item['type'] == 'audio':
-                caption = item.get('caption') or ''
-                if not is_anonymous and user:
-                    signature = format_user_signature(user)
-                    if signature:
-                        caption = f"{caption}\n\n{signature}" if caption else signature
-                if tags:
-                    tags_text = ' '.join(tags)
-                    caption = f"{caption}\n\n{tags_text}" if caption else tags_text
-                msg = await bot.send_audio(int(first_channel_id), item['file_id'], caption=caption if caption else None)
-            elif item['type'] == 'animation':
-                caption = item.get('caption') or ''
-                if not is_anonymous and user:
-                    signature = format_user_signature(user)
-                    if signature:
-                        caption = f"{caption}\n\n{signature}" if caption else signature
-                if tags:
-                    tags_text = ' '.join(tags)
-                    caption = f"{caption}\n\n{tags_text}" if caption else tags_text
-                msg = await bot.send_animation(int(first_channel_id), item['file_id'], caption=caption if caption else None)
+                text = build_caption(item['text'], is_anonymous, user, tags)
+                msgs = [await bot.send_message(chat_id, text)]
+            elif item['type'] in ('photo', 'video', 'document', 'audio', 'animation'):
+                caption = build_caption(item.get('caption') or '', is_anonymous, user, tags) or None
+                if item['type'] == 'photo':
+                    msgs = [await bot.send_photo(chat_id, item['file_id'], caption=caption)]
+                elif item['type'] == 'video':
+                    msgs = [await bot.send_video(chat_id, item['file_id'], caption=caption)]
+                elif item['type'] == 'document':
+                    msgs = [await bot.send_document(chat_id, item['file_id'], caption=caption, filename=item.get('file_name'))]
+                elif item['type'] == 'audio':
+                    msgs = [await bot.send_audio(chat_id, item['file_id'], caption=caption)]
+                else:
+                    msgs = [await bot.send_animation(chat_id, item['file_id'], caption=caption)]
             # 只要有消息就更新 message_id
-            if msg is not None:
-                first_channel_msg_id = msg.message_id
+            if msgs:
+                first_channel_msg_id = msgs[-1].message_id  # 取最后一条
+                plan.append({'message_ids': [m.message_id for m in msgs], 'media': media})
+            else:
+                plan.append({'item': item})
         # 获取频道用户名（用缓存）
-        first_channel_username = await get_channel_username(bot, int(first_channel_id))
-        print(f"频道ID: {first_channel_id}, 用户名: {first_channel_username}, 消息ID: {first_channel_msg_id}")
-    # 其他频道正常分发
-    for channel_id in channel_ids[1:]:
-        for item in grouped:
-            await send_item_to_chat(item, bot, int(channel_id), is_anonymous=is_anonymous, user=user, tags=tags)
-    return (first_channel_id, first_channel_username, first_channel_msg_id)
+        first_channel_username = await get_channel_username(bot, chat_id)
+        logger.debug("频道ID: %s, 用户名: %s, 消息ID: %s", first_channel_id, first_channel_username, first_channel_msg_id)
+    # 其他频道复制主频道的消息：后台并发进行，不阻塞发布确认
+    if first_channel_id and len(channel_ids) > 1:
+        spawn(replicate_to_channels(bot, int(first_channel_id), [int(c) for c in channel_ids[1:]], plan, is_anonymous, user, tags))
+    # 每条内容在主频道的消息ID列表（与 grouped 对应），用于记录媒体所在的频道消息
+    message_ids = [entry.get('message_ids', []) for entry in plan]
+    return (first_channel_id, first_channel_username, first_channel_msg_id, message_ids)
+
+async def replicate_to_channels(bot, from_chat_id, channel_ids, plan, is_anonymous=False, user=None, tags=None):
+    """并发复制到多个频道，返回每个频道的 DeliveryResult"""
+    results = await fan_out(
+        channel_ids,
+        lambda channel_id: replicate_to_channel(bot, from_chat_id, channel_id, plan, is_anonymous, user, tags)
+    )
+    failed = [r.destination for r in results if not r.ok]
+    if failed:
+        logger.warning("复制到频道失败: %s", failed)
+    return results
 
-pending_submissions = {}  # {submission_id: {'user_id':..., 'grouped':..., 'chat_id':..., 'message_id':..., 'admin_msg_ids': {admin_id: msg_id}}}
+# 审核队列，持久化到数据库，重启后管理员仍可审核
+pending_submissions = StateStore('pending_submissions', ttl=PENDING_SUBMISSION_TTL)  # {submission_id: {'user_id':..., 'grouped':..., 'chat_id':..., 'message_id':..., 'is_anonymous':..., 'admin_msg_ids': {admin_id: msg_id}}}
 
 # 拒绝原因输入状态管理
-rejection_reason_states = {}  # {admin_id: {'submission_id': ..., 'waiting_for_reason': True}}
+rejection_reason_states = StateStore('rejection_reason_states', ttl=ADMIN_INPUT_TTL, key_type=int, owns=owns_user)  # {admin_id: {'submission_id': ..., 'waiting_for_reason': True}}
 
 # 标签输入状态管理
-tag_input_states = {}  # {admin_id: {'submission_id': ..., 'waiting_for_tags': True}}
+tag_input_states = StateStore('tag_input_states', ttl=ADMIN_INPUT_TTL, key_type=int, owns=owns_user)  # {admin_id: {'submission_id': ..., 'waiting_for_tags': True}}
 
 # 常用标签列表
 COMMON_TAGS = ["#美食", "#新闻", "#科技", "#娱乐", "#体育", "#教育", "#健康", "#旅游", "#时尚", "#游戏", "#音乐", "#电影", "#书籍", "#生活", "#搞笑", "#萌宠", "#风景", "#美食", "#手工", "#教程"]
@@ -881,45 +875,30 @@ async def finish_handler(update: Update, context):
     admin_ids = load_admin_ids()
     is_anonymous = query.data == "finish_anonymous"
     user = query.from_user
-    buffer = user_buffers.get(user_id, [])
-    grouped = []
-    i = 0
-    while i < len(buffer):
-        msg = buffer[i]
-        message = getattr(msg, 'message', None) or getattr(msg, 'effective_message', None) or msg
-        media_group_id = getattr(message, 'media_group_id', None)
-        if media_group_id:
-            group_items = []
-            while i < len(buffer):
-                m = getattr(buffer[i], 'message', None) or getattr(buffer[i], 'effective_message', None) or buffer[i]
-                if getattr(m, 'media_group_id', None) == media_group_id:
-                    group_items.append(serialize_message(m))
-                    i += 1
-                else:
-                    break
-            grouped.append({'type': 'media_group', 'items': group_items})
-        else:
-            grouped.append(serialize_message(message))
-            i += 1
+    grouped = group_draft_items(user_buffers.get(user_id, []))
     if not grouped:
         await query.answer("没有待合并的内容。", show_alert=True)
         return
-    user_buffers[user_id].clear()
+    user_buffers.pop(user_id, None)
+    # 相同内容已发布过：直接给出已有链接，不再发布到频道、不再送审
+    existing = await run_db(find_existing_group, grouped)
+    if existing:
+        await query.edit_message_text("♻️ 相同内容已发布过，无需重复提交。")
+        await send_existing_group_link(context.bot, query.message.chat_id, existing)
+        await query.answer()
+        return
     if user_id in admin_ids:
         await query.edit_message_text("正在上传并生成链接，请稍候…")
-        print(f"🔍 finish_handler - 管理员投稿，用户ID: {user_id}")
-        print(f"🔍 内容数量: {len(grouped)}")
+        logger.debug("finish_handler - 管理员投稿，用户ID: %s，内容数量: %s", user_id, len(grouped))
         try:
             # 先发送内容到频道，并获取跳转信息
-            channel_id, channel_username, channel_msg_id = await send_group_to_channel(grouped, context.bot, is_anonymous=is_anonymous, user=user, tags=None)
-            print(f"🔍 内容已发送到频道")
-            from backend.utils import generate_group_id, store_group_mapping
-            group_id = generate_group_id()
-            print(f"🔍 生成的group_id: {group_id}")
-            store_group_mapping(group_id, grouped)
-            print(f"🔍 内容已存储到数据库")
+            channel_id, channel_username, channel_msg_id, message_ids = await send_group_to_channel(grouped, context.bot, is_anonymous=is_anonymous, user=user, tags=None)
+            group_id = await run_db(
+                store_group_mapping, None, grouped,
+                creator_id=user_id, channel_id=channel_id, channel_msg_ids=message_ids
+            )
             link = generate_link(group_id)
-            print(f"🔍 生成的链接: {link}")
+            logger.info("管理员 %s 生成内容组 %s（%s 条）", user_id, group_id, len(grouped))
             # 检查链接是否有效
             if link.startswith("⚠️"):
                 await context.bot.send_message(chat_id=query.message.chat_id, text=f"✅ 内容已上传到频道\n{link}")
@@ -928,12 +907,10 @@ async def finish_handler(update: Update, context):
                     [InlineKeyboardButton("点击访问内容", url=link)]
                 ])
                 await context.bot.send_message(chat_id=query.message.chat_id, text=f"✅ 链接已生成 👇\n{link}", reply_markup=keyboard)
-            await send_link_to_backup_channels(link, context.bot)
-            print(f"🔍 链接已发送给用户和备份频道")
+            spawn(send_link_to_backup_channels(link, context.bot))
             # 新增：发送"查看"按钮跳转到频道具体消息
             if channel_username and channel_msg_id:
                 jump_url = f"https://t.me/{channel_username}/{channel_msg_id}"
-                print(f"准备发跳转按钮: {jump_url}")
                 jump_keyboard = InlineKeyboardMarkup([
                     [InlineKeyboardButton("查看", url=jump_url)]
                 ])
@@ -941,7 +918,7 @@ async def finish_handler(update: Update, context):
             elif channel_msg_id:
                 await context.bot.send_message(chat_id=query.message.chat_id, text="🎉 您的投稿已发布到频道，但频道未设置用户名，无法跳转到具体消息。")
         except Exception as e:
-            print(f"🔍 finish_handler 错误: {e}")
+            logger.exception("finish_handler 错误: %s", e)
             await query.edit_message_text(f"❌ 生成链接时出现错误: {str(e)}")
         await query.answer()
     else:
@@ -952,31 +929,36 @@ async def finish_handler(update: Update, context):
             'grouped': grouped,
             'chat_id': query.message.chat_id,
             'message_id': query.message.message_id,
+            'is_anonymous': is_anonymous,
             'admin_msg_ids': {},
         }
         
-        # 添加调试信息
-        print(f"🔍 用户投稿 - 用户ID: {user_id}")
-        print(f"🔍 管理员列表: {admin_ids}")
-        print(f"🔍 投稿ID: {submission_id}")
-        print(f"🔍 内容数量: {len(grouped)}")
+        logger.info("用户 %s 投稿 %s（%s 条），等待审核", user_id, submission_id, len(grouped))
         
         admin_ids = load_admin_ids()
-        for admin_id in admin_ids:
-            try:
-                print(f"🔍 正在发送给管理员: {admin_id}")
-                msg_id = await send_group_to_admin_for_review(grouped, context.bot, admin_id, submission_id, user_id, is_anonymous=is_anonymous, tags=None)
-                pending_submissions[submission_id]['admin_msg_ids'][admin_id] = msg_id
-                print(f"🔍 成功发送给管理员 {admin_id}, 消息ID: {msg_id}")
-            except Exception as e:
-                print(f"🔍 发送给管理员 {admin_id} 失败: {e}")
-                # 即使发送失败也要继续处理其他管理员
+        # 并发发给所有管理员，单个管理员失败不影响其他管理员
+        limited_bot = RateLimitedBot(context.bot)
+        results = await fan_out(admin_ids, lambda admin_id: send_group_to_admin_for_review(
+            grouped, limited_bot, admin_id, submission_id, user_id, is_anonymous=is_anonymous, tags=None
+        ))
+        # 发送期间可能已被其他管理员审核（审核可能发生在其他进程）
+        await pending_submissions.refresh(submission_id)
+        if submission_id not in pending_submissions:
+            await query.answer()
+            return
+        submission = pending_submissions[submission_id]
+        for result in results:
+            if result.ok:
+                # 经 JSON 持久化后键为字符串，统一用字符串
+                submission['admin_msg_ids'][str(result.destination)] = result.result
+                logger.debug("投稿 %s 已发送给管理员 %s，消息ID: %s", submission_id, result.destination, result.result)
+            else:
+                logger.warning("投稿 %s 发送给管理员 %s 失败: %s", submission_id, result.destination, result.error)
+        pending_submissions.save(submission_id)
         
         await query.answer()
 
 async def send_group_to_admin_for_review(grouped, bot, admin_id, submission_id, user_id, is_anonymous=False, tags=None):
-    print(f"🔍 send_group_to_admin_for_review 开始 - 管理员ID: {admin_id}")
-    
     # 获取用户名
     user = await bot.get_chat(user_id)
     username = user.username if hasattr(user, 'username') and user.username else None
@@ -1005,20 +987,18 @@ async def send_group_to_admin_for_review(grouped, bot, admin_id, submission_id,
     ])
     try:
         sent = await bot.send_message(chat_id=admin_id, text=review_text, reply_markup=reply_markup, parse_mode='HTML')
-        print(f"🔍 审核消息已发送给管理员 {admin_id}")
         
         # 再推送内容本体
         for i, item in enumerate(grouped):
             try:
                 await send_item_to_chat(item, bot, admin_id, is_anonymous=is_anonymous, user=user, tags=tags)
-                print(f"🔍 内容项 {i+1}/{len(grouped)} 已发送给管理员 {admin_id}")
+                logger.debug("内容项 %s/%s 已发送给管理员 %s", i + 1, len(grouped), admin_id)
             except Exception as e:
-                print(f"🔍 发送内容项 {i+1} 给管理员 {admin_id} 失败: {e}")
-        
-        print(f"🔍 send_group_to_admin_for_review 完成 - 管理员ID: {admin_id}")
+                logger.warning("发送内容项 %s 给管理员 %s 失败: %s", i + 1, admin_id, e)
+
         return sent.message_id
     except Exception as e:
-        print(f"🔍 send_group_to_admin_for_review 失败 - 管理员ID: {admin_id}, 错误: {e}")
+        logger.warning("发送审核消息给管理员 %s 失败: %s", admin_id, e)
         raise e
 
 async def audit_handler(update: Update, context):
@@ -1045,6 +1025,7 @@ async def audit_handler(update: Update, context):
         if data.startswith("reject_with_reason_"):
             submission_id = data.split('_', 3)[3]  # 获取submission_id
             # 检查投稿是否存在
+            await pending_submissions.refresh(submission_id)
             if submission_id not in pending_submissions:
                 await query.answer("该投稿已被处理或已过期。", show_alert=True)
                 return
@@ -1063,7 +1044,7 @@ async def audit_handler(update: Update, context):
             )
             await query.answer()
             return
-        submission = pending_submissions.pop(submission_id, None)
+        submission = await pending_submissions.claim(submission_id)
         if not submission:
             await query.answer("该内容已被其他管理员审核。", show_alert=True)
             return
@@ -1075,7 +1056,7 @@ async def audit_handler(update: Update, context):
         for aid, msg_id in admin_msg_ids.items():
             try:
                 await context.bot.edit_message_text(
-                    chat_id=aid,
+                    chat_id=int(aid),
                     message_id=msg_id,
                     text=f"{emoji} <b>该投稿已被管理员 {admin_display} 审核{action}</b>",
                     parse_mode='HTML'
@@ -1086,16 +1067,26 @@ async def audit_handler(update: Update, context):
             # 从submission中获取匿名状态和标签
             is_anonymous = submission.get('is_anonymous', False)
             tags = submission.get('tags', [])
+            # 审核期间相同内容可能已通过其他投稿发布，直接沿用已有链接
+            existing = await run_db(find_existing_group, grouped)
+            if existing:
+                await context.bot.send_message(chat_id=chat_id, text="✅ 你的内容已通过审核（相同内容已发布过）：")
+                await send_existing_group_link(context.bot, chat_id, existing)
+                await context.bot.send_message(chat_id=admin_id, text="相同内容已发布过，已把已有链接发给用户。")
+                await query.answer("已通过")
+                return
             user = await context.bot.get_chat(user_id)
-            await send_group_to_channel(grouped, context.bot, is_anonymous=is_anonymous, user=user, tags=tags)
-            group_id = generate_group_id()
-            store_group_mapping(group_id, grouped)
+            channel_id, _, _, message_ids = await send_group_to_channel(grouped, context.bot, is_anonymous=is_anonymous, user=user, tags=tags)
+            group_id = await run_db(
+                store_group_mapping, None, grouped,
+                creator_id=user_id, channel_id=channel_id, channel_msg_ids=message_ids
+            )
             link = generate_link(group_id)
             keyboard = InlineKeyboardMarkup([
                 [InlineKeyboardButton("点击访问内容", url=link)]
             ])
             await context.bot.send_message(chat_id=chat_id, text=f"✅ 你的内容已通过审核，链接如下：\n{link}", reply_markup=keyboard)
-            await send_link_to_backup_channels(link, context.bot)
+            spawn(send_link_to_backup_channels(link, context.bot))
             await context.bot.send_message(chat_id=admin_id, text="已通过并推送到频道。")
             await query.answer("已通过")
         else:
@@ -1119,7 +1110,7 @@ async def handle_rejection_reason(update: Update, context):
     rejection_reason = update.message.text
     
     # 获取投稿信息
-    submission = pending_submissions.pop(submission_id, None)
+    submission = await pending_submissions.claim(submission_id)
     if not submission:
         await update.message.reply_text("❌ 该投稿已被其他管理员处理或已过期。")
         # 清除状态
@@ -1143,7 +1134,7 @@ async def handle_rejection_reason(update: Update, context):
     for aid, msg_id in admin_msg_ids.items():
         try:
             await context.bot.edit_message_text(
-                chat_id=aid,
+                chat_id=int(aid),
                 message_id=msg_id,
                 text=f"❌ <b>该投稿已被管理员 {admin_display} 拒绝并说明原因</b>",
                 parse_mode='HTML'
@@ -1214,6 +1205,7 @@ async def handle_tag_input(update: Update, context):
         return
     
     # 获取投稿信息
+    await pending_submissions.refresh(submission_id)
     submission = pending_submissions.get(submission_id, None)
     if not submission:
         await update.message.reply_text("❌ 该投稿已被处理或已过期。")
@@ -1224,6 +1216,7 @@ async def handle_tag_input(update: Update, context):
     
     # 添加标签到投稿数据
     submission['tags'] = formatted_tags
+    pending_submissions.save(submission_id)
     
     # 获取管理员信息
     admin_user = await context.bot.get_chat(user_id)
@@ -1291,19 +1284,19 @@ def serialize_message(m):
     if m.text:
         return {'type': 'text', 'text': m.text}
     if m.photo:
-        return {'type': 'photo', 'file_id': m.photo[-1].file_id, 'caption': m.caption or None}
+        return {'type': 'photo', 'file_id': m.photo[-1].file_id, 'file_unique_id': m.photo[-1].file_unique_id, 'caption': m.caption or None}
     if m.video:
-        return {'type': 'video', 'file_id': m.video.file_id, 'caption': m.caption or None}
+        return {'type': 'video', 'file_id': m.video.file_id, 'file_unique_id': m.video.file_unique_id, 'caption': m.caption or None}
     if m.document:
-        return {'type': 'document', 'file_id': m.document.file_id, 'caption': m.caption or None, 'file_name': getattr(m.document, 'file_name', None)}
+        return {'type': 'document', 'file_id': m.document.file_id, 'file_unique_id': m.document.file_unique_id, 'caption': m.caption or None, 'file_name': getattr(m.document, 'file_name', None)}
     if m.audio:
-        return {'type': 'audio', 'file_id': m.audio.file_id, 'caption': m.caption or None}
+        return {'type': 'audio', 'file_id': m.audio.file_id, 'file_unique_id': m.audio.file_unique_id, 'caption': m.caption or None}
     if m.voice:
-        return {'type': 'voice', 'file_id': m.voice.file_id}
+        return {'type': 'voice', 'file_id': m.voice.file_id, 'file_unique_id': m.voice.file_unique_id}
     if m.sticker:
-        return {'type': 'sticker', 'file_id': m.sticker.file_id}
+        return {'type': 'sticker', 'file_id': m.sticker.file_id, 'file_unique_id': m.sticker.file_unique_id}
     if m.animation:
-        return {'type': 'animation', 'file_id': m.animation.file_id, 'caption': m.caption or None}
+        return {'type': 'animation', 'file_id': m.animation.file_id, 'file_unique_id': m.animation.file_unique_id, 'caption': m.caption or None}
     if m.location:
         return {'type': 'location', 'latitude': m.location.latitude, 'longitude': m.location.longitude}
     if m.contact:
@@ -1315,13 +1308,57 @@ def serialize_message(m):
     if m.venue:
         return {'type': 'venue', 'latitude': m.venue.location.latitude, 'longitude': m.venue.location.longitude, 'title': m.venue.title, 'address': m.venue.address}
     if m.video_note:
-        return {'type': 'video_note', 'file_id': m.video_note.file_id}
+        return {'type': 'video_note', 'file_id': m.video_note.file_id, 'file_unique_id': m.video_note.file_unique_id}
     return {'type': 'unsupported'}
 
+# 单个相册最多 10 个媒体
+MEDIA_GROUP_LIMIT = 10
+
+def pack_media_items(items):
+    """
+    把连续的图片/视频（包括分开存储的单条和原有相册）合并成最多 10 个一组的相册，
+    返回 [('album', [媒体, ...]) | ('item', item)]；凑不成相册的单个媒体按原样单独发送。
+    """
+    batches = []
+    pending = []
+
+    def flush():
+        for i in range(0, len(pending), MEDIA_GROUP_LIMIT):
+            chunk = pending[i:i + MEDIA_GROUP_LIMIT]
+            if len(chunk) == 1:
+                batches.append(('item', chunk[0]))
+            else:
+                batches.append(('album', chunk))
+        pending.clear()
+
+    for item in items:
+        if item['type'] == 'media_group':
+            pending.extend(m for m in item['items'] if m['type'] in ('photo', 'video'))
+        elif item['type'] in ('photo', 'video'):
+            pending.append(item)
+        else:
+            flush()
+            batches.append(('item', item))
+    flush()
+    return batches
+
+@timed(FUNCTION_DURATION, "restore_group_to_user")
 async def restore_group_to_user(group, bot, chat_id):
-    for item in group['items']:
-        await send_item_to_chat(item, bot, chat_id)
+    """经该用户的发送队列按顺序发送内容，连续的图片/视频合并成相册，减少调用次数和限流"""
+    async with chat_queue(chat_id) as queue:
+        for kind, payload in pack_media_items(group['items']):
+            if kind == 'album':
+                media = [
+                    InputMediaPhoto(media=m['file_id'], caption=m.get('caption'))
+                    if m['type'] == 'photo' else
+                    InputMediaVideo(media=m['file_id'], caption=m.get('caption'))
+                    for m in payload
+                ]
+                await queue.send(bot.send_media_group, chat_id, media)
+            else:
+                await queue.send(send_item_to_chat, payload, bot, chat_id)
 
+@timed(FUNCTION_DURATION, "send_item_to_chat")
 async def send_item_to_chat(item, bot, chat_id, reply_markup=None, prefix=None, is_anonymous=False, user=None, tags=None):
     from telegram import InputMediaPhoto, InputMediaVideo
     if item['type'] == 'media_group':
@@ -1466,27 +1503,18 @@ async def listchannels_handler(update, context):
     channels = get_bound_channels()
     await update.message.reply_text("当前绑定频道ID列表：\n" + '\n'.join(channels) if channels else "无绑定频道")
 
-BACKUP_CHANNELS_PATH = os.path.join(os.path.dirname(__file__), '..', 'storage', 'backup_channels.json')
-
 def get_backup_channels():
-    if os.path.exists(BACKUP_CHANNELS_PATH):
-        with open(BACKUP_CHANNELS_PATH, 'r', encoding='utf-8-sig') as f:
-            return json.load(f)
-    return []
+    return get_config().backup_channels
 
 def add_backup_channel(channel_id):
     channels = get_backup_channels()
     if channel_id not in channels:
-        channels.append(channel_id)
-        with open(BACKUP_CHANNELS_PATH, 'w', encoding='utf-8-sig') as f:
-            json.dump(channels, f)
+        set_config_value("backup_channels", list(channels) + [channel_id])
 
 def remove_backup_channel(channel_id):
     channels = get_backup_channels()
     if channel_id in channels:
-        channels.remove(channel_id)
-        with open(BACKUP_CHANNELS_PATH, 'w', encoding='utf-8-sig') as f:
-            json.dump(channels, f)
+        set_config_value("backup_channels", [c for c in channels if c != channel_id])
 
 async def addbackupchannel_handler(update, context):
     user_id = update.effective_user.id
@@ -1514,15 +1542,16 @@ async def listbackupchannels_handler(update, context):
 
 async def send_link_to_backup_channels(link, bot):
     channels = get_backup_channels()
-    for channel_id in channels:
-        await bot.send_message(chat_id=int(channel_id), text=f"✅ 链接已生成 👇\n{link}")
+    limited_bot = RateLimitedBot(bot)
+    return await fan_out([int(c) for c in channels], lambda channel_id: limited_bot.send_message(chat_id=channel_id, text=f"✅ 链接已生成 👇\n{link}"))
 
 async def cancel_handler(update: Update, context):
     query = update.callback_query
     user_id = query.from_user.id
-    user_buffers[user_id].clear()
-    user_media_group_buffers[user_id]['media'].clear()
-    user_media_group_buffers[user_id]['timer'] = None
+    user_buffers.pop(user_id, None)
+    buf = user_media_group_buffers.pop(user_id, None)
+    if buf and buf['timer']:
+        buf['timer'].cancel()
     await query.edit_message_text("已取消。")
     await query.answer()
 
@@ -1542,6 +1571,8 @@ COMMAND_DESCRIPTIONS = {
     '/listbackupchannels': '列出所有备用频道',
     '/forcefollow': '强制关注频道管理（仅管理员）',
     '/broadcast': '广播消息和通知给所有用户（仅管理员）',
+    '/cachestats': '查看缓存命中和更新处理统计（仅管理员）',
+    '/profile': '运行时性能分析（仅管理员）',
     '/qbzhiling': '显示所有机器人指令及其描述',
 }
 
@@ -1575,6 +1606,82 @@ async def cancel_tags_handler(update, context):
     else:
         await update.message.reply_text("❌ 当前没有等待输入的标签。")
 
+async def cachestats_handler(update, context):
+    """查看缓存命中情况（仅管理员）"""
+    user_id = update.effective_user.id
+    admin_ids = load_admin_ids()
+    if user_id not in admin_ids:
+        await update.message.reply_text("无权限，仅管理员可用。")
+        return
+    text = "🗂 缓存统计\n"
+    for name, stats in (("内容缓存", get_group_cache_stats()), ("关注检查缓存", membership_cache.stats())):
+        text += (
+            f"\n【{name}】\n"
+            f"• 条目：{stats['size']}/{stats['maxsize']}\n"
+            f"• 命中：{stats['hits']} 次，未命中：{stats['misses']} 次，命中率：{stats['hit_rate']*100:.1f}%\n"
+            f"• 淘汰：{stats['evictions']} 次"
+        )
+        if stats['max_bytes']:
+            text += f"\n• 占用：{stats['bytes'] / 1024:.1f} KB / {stats['max_bytes'] / 1024:.1f} KB"
+        text += "\n"
+    if hasattr(context.application, "update_stats"):
+        stats = context.application.update_stats()
+        text += (
+            f"\n【更新处理】\n"
+            f"• 队列中：{stats['queued']}，等待中：{stats['waiting']}，处理中：{stats['running']}/{stats['concurrency']}\n"
+            f"• 已处理：{stats['processed']}，最多同时积压：{stats['max_pending']}/{stats['pending_limit']}\n"
+        )
+    await update.message.reply_text(text)
+
+async def profile_handler(update, context):
+    """运行时性能分析（仅管理员）：采样事件循环 N 秒，结束后把热点函数和慢回调发给管理员"""
+    user_id = update.effective_user.id
+    admin_ids = load_admin_ids()
+    if user_id not in admin_ids:
+        await update.message.reply_text("无权限，仅管理员可用。")
+        return
+    usage = (
+        "用法：/profile <秒数> [慢回调阈值毫秒]\n"
+        f"如：/profile 30 或 /profile 30 50（最长 {PROFILE_MAX_DURATION:g} 秒，默认阈值 {PROFILE_SLOW_CALLBACK * 1000:g} 毫秒）\n"
+        "/profile stop - 提前结束并发送结果"
+    )
+    if not context.args:
+        status = "进行中" if get_active_session() else "未开启"
+        await update.message.reply_text(f"🔬 性能分析：{status}\n\n{usage}")
+        return
+    if context.args[0].lower() == "stop":
+        if not stop_profiling():
+            await update.message.reply_text("当前没有进行中的性能分析。")
+        return
+    try:
+        duration = float(context.args[0])
+        threshold = float(context.args[1]) / 1000 if len(context.args) > 1 else PROFILE_SLOW_CALLBACK
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+    if duration <= 0 or threshold <= 0:
+        await update.message.reply_text(usage)
+        return
+    try:
+        session = start_profiling(duration, threshold)
+    except RuntimeError:
+        await update.message.reply_text("已有性能分析在进行中，可发送 /profile stop 提前结束。")
+        return
+    await update.message.reply_text(f"🔬 已开始性能分析 {session.duration:g} 秒，结束后发送结果。")
+    spawn(send_profile_report(session, context.bot, update.effective_chat.id))
+
+async def send_profile_report(session, bot, chat_id):
+    report = await collect_report(session)
+    # 单条消息最长 4096 字符，按行拆分
+    chunk = ""
+    for line in report.split("\n"):
+        if len(chunk) + len(line) + 1 > 4000:
+            await bot.send_message(chat_id=chat_id, text=chunk)
+            chunk = ""
+        chunk += line + "\n"
+    if chunk.strip():
+        await bot.send_message(chat_id=chat_id, text=chunk)
+
 async def qbzhiling_handler(update, context):
     text = '【机器人指令列表】\n'
     for cmd, desc in COMMAND_DESCRIPTIONS.items():
@@ -1593,7 +1700,7 @@ async def forcefollow_handler(update, context):
         return
     
     action = context.args[0].lower()
-    config = get_force_follow_config()
+    config = dict(get_force_follow_config())
     
     if action == "on":
         if not config["channel_id"]:
@@ -1624,6 +1731,7 @@ async def forcefollow_handler(update, context):
             config["channel_id"] = channel_id
             config["channel_username"] = chat.username or ""
             save_force_follow_config(config)
+            membership_cache.clear()
             await update.message.reply_text(f"✅ 强制关注频道已设置：\n频道：{chat.title}\nID：{channel_id}")
         except Exception as e:
             await update.message.reply_text(f"❌ 设置失败：{str(e)}\n请确保机器人是频道管理员！")
@@ -1634,12 +1742,17 @@ async def forcefollow_handler(update, context):
         await update.message.reply_text(f"📊 强制关注设置状态：\n\n状态：{status}\n频道：{channel_info}")
         
     elif action == "stats":
-        stats = get_follow_stats()
+        stats = await run_db(get_follow_stats)
+        cache_stats = membership_cache.stats()
         await update.message.reply_text(
             f"📈 关注统计报告\n\n"
             f"总关注人数：{stats['total_follows']} 人\n"
             f"今日关注：{stats['today_follows']} 人\n"
-            f"最后更新：{stats['last_reset_date'] or '无数据'}\n\n"
+            f"最后关注：{stats['last_follow_at'][:10] if stats['last_follow_at'] else '无数据'}\n\n"
+            f"🗂 关注检查缓存：\n"
+            f"• 命中：{cache_stats['hits']} 次，未命中：{cache_stats['misses']} 次\n"
+            f"• 命中率：{cache_stats['hit_rate']*100:.1f}%\n"
+            f"• 缓存条目：{cache_stats['size']}/{cache_stats['maxsize']}\n\n"
             f"💡 统计说明：\n"
             f"• 只统计通过强制关注检查的用户\n"
             f"• 每个用户只统计一次\n"
@@ -1647,12 +1760,7 @@ async def forcefollow_handler(update, context):
         )
         
     elif action == "reset":
-        stats = get_follow_stats()
-        stats["total_follows"] = 0
-        stats["today_follows"] = 0
-        stats["follow_records"] = []
-        stats["last_reset_date"] = ""
-        save_follow_stats(stats)
+        await run_db(reset_follow_stats)
         await update.message.reply_text("✅ 统计数据已重置！")
         
     else:
@@ -1690,10 +1798,8 @@ async def broadcast_handler(update: Update, context):
     
     if action == "start":
         # 开始广播模式
-        print(f"🔍 执行 /broadcast start - 用户ID: {user_id}")
-        print(f"🔍 广播模式用户 (之前): {broadcast_mode_users}")
-        broadcast_mode_users.add(user_id)  # 添加用户到广播模式
-        print(f"🔍 广播模式用户 (之后): {broadcast_mode_users}")
+        broadcast_mode_users[user_id] = True  # 添加用户到广播模式
+        logger.debug("管理员 %s 进入广播模式", user_id)
         
         await update.message.reply_text(
             "📢 广播模式已开启！\n\n"
@@ -1703,18 +1809,19 @@ async def broadcast_handler(update: Update, context):
         )
     elif action == "stats":
         # 显示用户统计
-        users = get_users()
-        total_users = len(users)
-        active_users = len([u for u in users if u.get('last_active')])
+        stats = await run_db(get_user_stats)
+        group_stats = await run_db(get_group_stats)
         await update.message.reply_text(
             f"📊 用户统计：\n\n"
-            f"总用户数：{total_users} 人\n"
-            f"活跃用户：{active_users} 人\n"
-            f"今日新增：{len([u for u in users if u.get('joined_at', '').startswith(datetime.now().strftime('%Y-%m-%d'))])} 人"
+            f"总用户数：{stats['total']} 人\n"
+            f"活跃用户：{stats['active']} 人\n"
+            f"今日新增：{stats['today_new']} 人\n"
+            f"已失效（拉黑/注销）：{stats['inactive']} 人，不计入总数且不再广播\n\n"
+            f"📦 内容链接：共 {group_stats['total']} 个，今日新增 {group_stats['today']} 个，近 7 天 {group_stats['week']} 个"
         )
     elif action == "history":
         # 显示广播历史
-        history = get_broadcast_history()
+        history = await get_broadcast_history()
         if not history:
             await update.message.reply_text("📝 暂无广播历史记录。")
             return
@@ -1727,18 +1834,31 @@ async def broadcast_handler(update: Update, context):
     elif action == "status":
         # 显示广播状态
         is_in_broadcast_mode = user_id in broadcast_mode_users
-        users = get_users()
+        user_count = await run_db(count_users)
         
         status_text = "📢 广播状态：\n\n"
         if is_in_broadcast_mode:
             status_text += "🟢 当前状态：广播模式已开启\n"
-            status_text += f"👥 目标用户：{len(users)} 人\n"
+            status_text += f"👥 目标用户：{user_count} 人\n"
             status_text += "💡 请发送要广播的内容"
         else:
             status_text += "🔴 当前状态：普通模式\n"
-            status_text += f"👥 总用户数：{len(users)} 人\n"
+            status_text += f"👥 总用户数：{user_count} 人\n"
             status_text += "💡 发送 /broadcast start 开始广播模式"
         
+        # 正在运行的广播任务：可能在其他工作进程中运行，从数据库读取（进度为最近一次保存的）；本进程运行的任务显示实时进度
+        jobs = await run_db(get_unfinished_jobs)
+        if jobs:
+            status_text += f"\n\n📤 进行中的任务：{len(jobs)} 个"
+            for job in jobs:
+                running = active_jobs.get(job["job_id"])
+                if running:
+                    done, success, failed = running.done_count, running.success_count, running.failed_count
+                else:
+                    done, success, failed = job["success_count"] + job["failed_count"], job["success_count"], job["failed_count"]
+                stopping = "（正在停止）" if job["cancel_requested"] else ""
+                status_text += f"\n• {job['job_id']}：{done}/{job['total']}，成功 {success}，失败 {failed}{stopping}"
+        
         await update.message.reply_text(status_text)
     elif action == "notify":
         # 发送广播通知
@@ -1747,9 +1867,9 @@ async def broadcast_handler(update: Update, context):
             return
         
         notification_text = ' '.join(context.args[1:])
-        users = get_users()
+        user_count = await run_db(count_users)
         
-        if not users:
+        if not user_count:
             await update.message.reply_text("❌ 没有用户可发送通知。")
             return
         
@@ -1765,16 +1885,16 @@ async def broadcast_handler(update: Update, context):
         await update.message.reply_text(
             f"📢 确认发送通知\n\n"
             f"通知内容：{notification_text}\n"
-            f"发送给：{len(users)} 个用户\n\n"
+            f"发送给：{user_count} 个用户\n\n"
             f"⚠️ 此操作不可撤销，请确认！",
             reply_markup=keyboard
         )
     else:
         # 直接发送文本广播（新功能）
         text_content = ' '.join(context.args)
-        users = get_users()
+        user_count = await run_db(count_users)
         
-        if not users:
+        if not user_count:
             await update.message.reply_text("❌ 没有用户可发送广播。")
             return
         
@@ -1790,7 +1910,7 @@ async def broadcast_handler(update: Update, context):
         await update.message.reply_text(
             f"📢 快速广播\n\n"
             f"内容：{text_content}\n"
-            f"发送给：{len(users)} 个用户\n\n"
+            f"发送给：{user_count} 个用户\n\n"
             f"⚠️ 此操作不可撤销，请确认！",
             reply_markup=keyboard
         )
@@ -1800,23 +1920,17 @@ async def broadcast_handler(update: Update, context):
 async def broadcast_media_group_wait_and_confirm(user_id, context):
     """等待媒体组完成并确认"""
     await asyncio.sleep(2.5)  # 等待2.5秒
-    buf = broadcast_media_group_buffers[user_id]
+    buf = broadcast_media_group_buffers.pop(user_id, None)
     
     # 处理媒体组
-    if buf['media']:
-        media_group_id = buf['last_group_id']
-        group_items = []
-        for update in buf['media']:
-            message = update.message
-            group_items.append(serialize_message(message))
+    if buf and buf['media']:
+        group_items = buf['media']
         
         # 单内容模式：直接设置广播内容
         broadcast_buffers[user_id] = [{'type': 'media_group', 'items': group_items}]
-        buf['media'].clear()
-        buf['timer'] = None
         
         # 获取用户数量
-        users = get_users()
+        user_count = await run_db(count_users)
         
         # 显示确认界面
         keyboard = InlineKeyboardMarkup([
@@ -1828,7 +1942,7 @@ async def broadcast_media_group_wait_and_confirm(user_id, context):
         message_text = f"📢 广播确认\n\n"
         message_text += f"内容类型：媒体组\n"
         message_text += f"内容数量：{len(group_items)} 个文件\n"
-        message_text += f"发送给：{len(users)} 个用户\n\n"
+        message_text += f"发送给：{user_count} 个用户\n\n"
         message_text += "⚠️ 此操作不可撤销，请确认！"
         
         await context.bot.send_message(
@@ -1838,8 +1952,18 @@ async def broadcast_media_group_wait_and_confirm(user_id, context):
         )
         
         # 退出广播模式
-        broadcast_mode_users.discard(user_id)
-        print(f"🔍 已退出广播模式，用户ID: {user_id}")
+        broadcast_mode_users.pop(user_id, None)
+        logger.debug("已退出广播模式，用户ID: %s", user_id)
+
+async def send_notification_item(item, bot, chat_id):
+    """以 HTML 格式发送系统通知"""
+    await bot.send_message(chat_id=chat_id, text=item['text'], parse_mode='HTML')
+
+# 各类广播任务的单条发送函数，用于重启后继续任务
+BROADCAST_SENDERS = {
+    "broadcast": send_item_to_chat,
+    "notification": send_notification_item,
+}
 
 async def broadcast_callback_handler(update: Update, context):
     """处理广播相关的回调"""
@@ -1858,65 +1982,28 @@ async def broadcast_callback_handler(update: Update, context):
             await query.answer("❌ 没有待广播的内容！", show_alert=True)
             return
         
-        users = get_users()
-        if not users:
+        if not await run_db(count_users):
             await query.answer("❌ 没有用户可发送广播！", show_alert=True)
             return
         
         await query.edit_message_text("📤 正在发送广播，请稍候...")
         
-        success_count = 0
-        failed_count = 0
-        failed_users = []
-        
-        for user_info in users:
-            try:
-                user_id_target = user_info["user_id"]
-                # 发送内容给用户
-                for item in buffer:
-                    await send_item_to_chat(item, context.bot, user_id_target)
-                success_count += 1
-                await asyncio.sleep(0.1)  # 避免频率限制
-            except Exception as e:
-                failed_count += 1
-                failed_users.append(str(user_id_target))
-                print(f"发送广播给用户 {user_id_target} 失败: {e}")
-        
-        # 保存广播历史
-        broadcast_info = {
-            "timestamp": datetime.now().isoformat(),
-            "admin_id": user_id,
-            "type": "broadcast",
-            "total_users": len(users),
-            "success_count": success_count,
-            "failed_count": failed_count
-        }
-        save_broadcast_history(broadcast_info)
-        
-        # 清空广播缓冲区
-        broadcast_buffers[user_id].clear()
-        
-        result_text = (
-            f"✅ 广播发送完成！\n\n"
-            f"📊 发送统计：\n"
-            f"• 总用户数：{len(users)} 人\n"
-            f"• 发送成功：{success_count} 人\n"
-            f"• 发送失败：{failed_count} 人\n"
-            f"• 成功率：{success_count/len(users)*100:.1f}%"
+        # 后台运行广播任务，进度会定时更新到当前消息
+        job = await start_broadcast(
+            context.bot, user_id, "broadcast", list(buffer), send_item_to_chat,
+            query.message.chat_id, query.message.message_id
         )
+        logger.info("广播任务 %s 已启动，目标用户 %s 人", job.job_id, job.total)
         
-        if failed_users:
-            result_text += f"\n\n❌ 失败用户（前10个）：\n" + "\n".join(failed_users[:10])
-        
-        await query.edit_message_text(result_text)
+        # 清空广播缓冲区
+        broadcast_buffers.pop(user_id, None)
     
     elif query.data == "cancel_broadcast":
         # 取消广播
-        broadcast_buffers[user_id].clear()
-        broadcast_media_group_buffers[user_id]['media'].clear()
-        if broadcast_media_group_buffers[user_id]['timer']:
-            broadcast_media_group_buffers[user_id]['timer'].cancel()
-            broadcast_media_group_buffers[user_id]['timer'] = None
+        broadcast_buffers.pop(user_id, None)
+        buf = broadcast_media_group_buffers.pop(user_id, None)
+        if buf and buf['timer']:
+            buf['timer'].cancel()
         await query.edit_message_text("❌ 广播已取消。")
     
     elif query.data == "preview_broadcast":
@@ -1947,9 +2034,7 @@ async def broadcast_callback_handler(update: Update, context):
     
     elif query.data == "send_notification":
         # 发送通知
-        users = get_users()
-        
-        if not users:
+        if not await run_db(count_users):
             await query.answer("❌ 没有用户可发送通知！", show_alert=True)
             return
         
@@ -1961,44 +2046,24 @@ async def broadcast_callback_handler(update: Update, context):
         
         await query.edit_message_text("📤 正在发送通知，请稍候...")
         
-        success_count = 0
-        failed_count = 0
-        
-        for user_info in users:
-            try:
-                user_id_target = user_info["user_id"]
-                await context.bot.send_message(
-                    chat_id=user_id_target,
-                    text=formatted_notification,
-                    parse_mode='HTML'
-                )
-                success_count += 1
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                failed_count += 1
-                print(f"发送通知给用户 {user_id_target} 失败: {e}")
-        
-        # 保存通知历史
-        notification_info = {
-            "timestamp": datetime.now().isoformat(),
-            "admin_id": user_id,
-            "type": "notification",
-            "total_users": len(users),
-            "success_count": success_count,
-            "failed_count": failed_count
-        }
-        save_broadcast_history(notification_info)
-        
-        result_text = (
-            f"✅ 系统通知发送完成！\n\n"
-            f"📊 发送统计：\n"
-            f"• 总用户数：{len(users)} 人\n"
-            f"• 发送成功：{success_count} 人\n"
-            f"• 发送失败：{failed_count} 人\n"
-            f"• 成功率：{success_count/len(users)*100:.1f}%"
+        job = await start_broadcast(
+            context.bot, user_id, "notification", [{'type': 'text', 'text': formatted_notification}], send_notification_item,
+            query.message.chat_id, query.message.message_id
         )
-        
-        await query.edit_message_text(result_text)
+        logger.info("通知任务 %s 已启动，目标用户 %s 人", job.job_id, job.total)
+    
+    elif query.data.startswith("stop_broadcast_"):
+        # 停止正在运行的广播
+        job_id = query.data.replace("stop_broadcast_", "")
+        # 任务可能在其他工作进程中运行：写入停止标记，由运行任务的进程读取；在本进程运行的直接停止
+        if not await run_db(request_cancel, job_id):
+            await query.answer("该广播已结束。", show_alert=True)
+            return
+        job = active_jobs.get(job_id)
+        if job:
+            job.cancel()
+        await query.answer("⏹ 正在停止广播…")
+        return
     
     elif query.data == "cancel_notification":
         await query.edit_message_text("❌ 通知发送已取消。")
@@ -2021,13 +2086,15 @@ def register_handlers(application):
     application.add_handler(CommandHandler("forcefollow", forcefollow_handler))
     application.add_handler(CommandHandler("broadcast", broadcast_handler))
     application.add_handler(CommandHandler("qbzhiling", qbzhiling_handler))
+    application.add_handler(CommandHandler("cachestats", cachestats_handler))
+    application.add_handler(CommandHandler("profile", profile_handler))
     application.add_handler(CommandHandler("cancel_reason", cancel_reason_handler))
     
     application.add_handler(CallbackQueryHandler(finish_handler, pattern="^(finish_signed|finish_anonymous)$"))
     application.add_handler(CallbackQueryHandler(audit_handler, pattern="^(approve_|reject_).*$"))
     application.add_handler(CallbackQueryHandler(cancel_handler, pattern="^cancel$"))
     application.add_handler(CallbackQueryHandler(button_handler, pattern="^(help|start|admin_manage|check_follow_|add_tags_|remove_tags_|cancel_tags|cancel_reason).*$"))
-    application.add_handler(CallbackQueryHandler(broadcast_callback_handler, pattern="^(confirm_broadcast|cancel_broadcast|preview_broadcast|send_notification|cancel_notification)$"))
+    application.add_handler(CallbackQueryHandler(broadcast_callback_handler, pattern="^(confirm_broadcast|cancel_broadcast|preview_broadcast|send_notification|cancel_notification|stop_broadcast_.+)$"))
     
     # 使用MessageHandler处理非命令消息（放在最后，避免拦截命令）
     application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, content_handler)) 
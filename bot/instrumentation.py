@@ -0,0 +1,71 @@
+import time
+import functools
+from telegram.request import HTTPXRequest
+from backend.metrics import Counter, Histogram, Collected
+
+HANDLER_DURATION = Histogram("bot_handler_duration_seconds", "处理函数耗时", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "处理函数抛出的异常", ["handler", "error"])
+API_DURATION = Histogram("bot_api_request_duration_seconds", "Bot API 调用耗时", ["method"])
+API_REQUESTS = Counter("bot_api_requests_total", "Bot API 调用次数，outcome 为 ok 或异常类型（RetryAfter、Forbidden 等）", ["method", "outcome"])
+FUNCTION_DURATION = Histogram("bot_function_duration_seconds", "关键发送函数耗时", ["function"])
+
+class InstrumentedRequest(HTTPXRequest):
+    """记录每次 Bot API 调用的耗时和结果（成功或异常类型），通过 ApplicationBuilder.request 使用"""
+
+    async def post(self, url, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            result = await super().post(url, *args, **kwargs)
+        except Exception as e:
+            API_REQUESTS.inc(method, type(e).__name__)
+            raise
+        finally:
+            API_DURATION.observe(time.perf_counter() - start, method)
+        API_REQUESTS.inc(method, "ok")
+        return result
+
+def _instrument_callback(callback):
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - start, name)
+    return wrapper
+
+def instrument_handlers(application):
+    """给已注册的所有处理函数加上耗时和异常统计，在 register_handlers 之后调用"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not getattr(handler.callback, "__wrapped__", None):
+                handler.callback = _instrument_callback(handler.callback)
+
+def register_collectors(application):
+    """注册抓取时计算的指标：更新队列、数据库写队列、缓存命中、草稿占用、广播任务等"""
+    from backend.db import db_stats
+    from backend.utils import get_group_cache_stats
+    from bot.broadcast import active_jobs
+    from bot.delivery import delivery_stats
+    from bot.handlers import membership_cache, user_buffers
+
+    if hasattr(application, "update_stats"):
+        Collected("bot_updates", "更新处理情况（queued/waiting/running）",
+                  lambda: {(k,): v for k, v in application.update_stats().items() if k in ("queued", "waiting", "running")}, ["state"])
+        Collected("bot_updates_processed_total", "已处理的更新数", lambda: application.update_stats()["processed"], type="counter")
+    Collected("bot_db_pending_operations", "数据库线程中排队的操作数", lambda: db_stats()["pending"])
+
+    def cache_stats():
+        return {"group": get_group_cache_stats(), "membership": membership_cache.stats()}
+    Collected("bot_cache_hits_total", "缓存命中次数", lambda: {(n,): s["hits"] for n, s in cache_stats().items()}, ["cache"], type="counter")
+    Collected("bot_cache_misses_total", "缓存未命中次数", lambda: {(n,): s["misses"] for n, s in cache_stats().items()}, ["cache"], type="counter")
+    Collected("bot_cache_entries", "缓存条目数", lambda: {(n,): s["size"] for n, s in cache_stats().items()}, ["cache"])
+    Collected("bot_draft_bytes", "内存中草稿的估算占用（字节）", lambda: user_buffers.stats()["bytes"])
+    Collected("bot_broadcasts_active", "进行中的广播任务数", lambda: len(active_jobs))
+    Collected("bot_chat_queues", "进行中的单聊天发送队列数", lambda: delivery_stats()["chat_queues"])
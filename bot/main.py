@@ -1,14 +1,97 @@
 import os
+import asyncio
 from dotenv import load_dotenv
-from telegram.ext import Application
-from bot.handlers import register_handlers
 
+# 先加载 .env，各模块在导入时读取配置
 load_dotenv()
 
+# 日志在其他模块导入前配置，导入时的迁移等日志也能输出
+from backend.log import setup_logging
+setup_logging()
+
+from telegram.ext import Application
+from bot.handlers import register_handlers, BROADCAST_SENDERS
+from bot.broadcast import resume_broadcasts, stop_all_broadcasts
+from bot.delivery import drain_background_tasks
+from bot.updates import OrderedApplication, UPDATE_MAX_PENDING, UPDATE_QUEUE_SIZE
+from bot.cluster import BOT_WORKERS, WORKER_INDEX, is_primary_worker
+from bot.instrumentation import InstrumentedRequest, instrument_handlers, register_collectors
+from backend.metrics import start_metrics_server, METRICS_PORT
+from backend.users import activity_flush_loop, flush_user_activity
+from backend.db import run_db, close_db
+from backend.storage import get_storage
+from backend.config import reload_config, config_watch_loop
+from backend.sessions import session_sweep_loop
+from backend.profiler import stop_profiling
+from backend.utils import content_expiry_loop, CONTENT_RETENTION_DAYS
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# 运行方式：polling（默认，长轮询）或 webhook（内置 HTTP 接收端，见 bot/webhook.py）
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Bot API 地址，默认官方服务器；可指向自建的 Bot API 服务（或 bench/ 中的模拟服务器）
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+# 用户活跃度批量落盘间隔（秒）
+USER_ACTIVITY_FLUSH_INTERVAL = float(os.getenv("USER_ACTIVITY_FLUSH_INTERVAL", "10"))
+
+background_tasks = []
+metrics_servers = []
+
+async def post_init(application):
+    background_tasks.append(asyncio.create_task(activity_flush_loop(USER_ACTIVITY_FLUSH_INTERVAL)))
+    # 多进程时配置文件只由 0 号工作进程导入，其他进程通过数据库变化载入
+    background_tasks.append(asyncio.create_task(config_watch_loop(import_files=is_primary_worker())))
+    background_tasks.append(asyncio.create_task(session_sweep_loop()))
+    if METRICS_PORT:
+        # 多进程时各工作进程依次使用 METRICS_PORT + 编号
+        metrics_servers.append(await start_metrics_server(port=METRICS_PORT + (WORKER_INDEX or 0)))
+    # 继续重启前未完成的广播、清理过期内容（多进程时只在 0 号工作进程中进行）
+    if is_primary_worker():
+        await resume_broadcasts(application.bot, BROADCAST_SENDERS)
+        if CONTENT_RETENTION_DAYS:
+            background_tasks.append(asyncio.create_task(content_expiry_loop()))
+
+async def post_shutdown(application):
+    await stop_all_broadcasts()
+    # 结束进行中的性能分析，结果在下面等待后台任务时发出
+    stop_profiling()
+    await drain_background_tasks()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    for server in metrics_servers:
+        server.close()
+    await run_db(flush_user_activity)
+    close_db()
+
+# 载入配置（并导入 storage/ 下的配置文件）生成配置快照，之后的读取都走内存
+get_storage()
+reload_config()
 
-application = Application.builder().token(BOT_TOKEN).build()
+# 不同聊天的更新并发处理，同一聊天内按顺序处理（见 bot/updates.py）
+application = (
+    Application.builder().token(BOT_TOKEN).base_url(TELEGRAM_API_URL)
+    .application_class(OrderedApplication)
+    # 与默认一样使用 256 个连接，另外记录每次 Bot API 调用的耗时和结果
+    .request(InstrumentedRequest(connection_pool_size=256))
+    .concurrent_updates(UPDATE_MAX_PENDING)
+    .update_queue(asyncio.Queue(UPDATE_QUEUE_SIZE))
+    .post_init(post_init).post_shutdown(post_shutdown)
+    .build()
+)
 register_handlers(application)
+instrument_handlers(application)
+register_collectors(application)
 
 if __name__ == "__main__":
-    application.run_polling() 
\ No newline at end of file
+    if WORKER_INDEX is not None:
+        from bot.cluster import run_worker
+        run_worker(application)
+    elif BOT_MODE == "webhook" and BOT_WORKERS > 1:
+        from bot.cluster import run_dispatcher
+        run_dispatcher(BOT_TOKEN)
+    elif BOT_MODE == "webhook":
+        from bot.webhook import run_webhook
+        run_webhook(application)
+    else:
+        application.run_polling()
@@ -0,0 +1,116 @@
+import os
+import time
+import asyncio
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+# Telegram 全局发送上限约 30 条/秒，同一聊天约 1 条/秒
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "28"))
+PER_CHAT_INTERVAL = float(os.getenv("TELEGRAM_PER_CHAT_INTERVAL", "1.0"))
+MAX_RETRIES = 5
+
+# 发送失败分类
+ERROR_UNREACHABLE = 'unreachable'  # 拉黑、注销、聊天不存在：永久失败
+ERROR_TRANSIENT = 'transient'      # 限流、超时、网络错误：可重试
+ERROR_FAILED = 'failed'            # 其他错误（如内容不合法）
+
+_UNREACHABLE_MESSAGES = (
+    "bot was blocked",
+    "user is deactivated",
+    "chat not found",
+    "user not found",
+    "peer_id_invalid",
+    "bot can't initiate conversation",
+    "bot was kicked",
+)
+
+def classify_send_error(e):
+    """把 Bot API 异常归类为 unreachable / transient / failed"""
+    if isinstance(e, RetryAfter):
+        return ERROR_TRANSIENT
+    message = str(e).lower()
+    if isinstance(e, Forbidden) or (isinstance(e, BadRequest) and any(m in message for m in _UNREACHABLE_MESSAGES)):
+        return ERROR_UNREACHABLE
+    if isinstance(e, BadRequest):
+        return ERROR_FAILED
+    if isinstance(e, (TimedOut, NetworkError)):
+        return ERROR_TRANSIENT
+    return ERROR_FAILED
+
+class TokenBucket:
+    """令牌桶限速器，收到 RetryAfter 时暂停并降速，之后逐步恢复到目标速率"""
+
+    def __init__(self, rate, capacity=None, min_rate=1.0):
+        self.target_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_retry_after(self, seconds):
+        """被限流：暂停 seconds 秒，速率减为 70%"""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = now + seconds
+        self.rate = max(self.min_rate, self.rate * 0.7)
+
+    def on_success(self):
+        """发送成功：速率线性恢复"""
+        if self.rate < self.target_rate:
+            self.rate = min(self.target_rate, self.rate + 0.05)
+
+    def idle(self):
+        """令牌已满、未暂停、速率已恢复：此时丢弃该限速器与新建一个等价"""
+        now = time.monotonic()
+        if now < self._paused_until or self.rate < self.target_rate:
+            return False
+        self._refill(now)
+        return self._tokens >= self.capacity
+
+# 所有批量发送（广播等）共用的全局限速器
+global_limiter = TokenBucket(GLOBAL_RATE)
+
+async def call_with_retry(func, *args, limiter=global_limiter, max_retries=MAX_RETRIES, **kwargs):
+    """经限速器调用 Bot API，遇到 RetryAfter 或超时/网络错误自动等待后重试"""
+    attempt = 0
+    while True:
+        await limiter.acquire()
+        try:
+            result = await func(*args, **kwargs)
+        except RetryAfter as e:
+            attempt += 1
+            limiter.on_retry_after(e.retry_after)
+            if attempt > max_retries:
+                raise
+            continue
+        except (TimedOut, NetworkError) as e:
+            # BadRequest 也是 NetworkError 的子类，但属于不可重试的错误
+            if isinstance(e, BadRequest):
+                raise
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            await asyncio.sleep(min(2 ** attempt, 30))
+            continue
+        limiter.on_success()
+        return result
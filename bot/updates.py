@@ -0,0 +1,172 @@
+import os
+import asyncio
+from collections import deque
+import telegram
+from telegram import Update
+from telegram.ext import Application
+
+# OrderedApplication 替换了 Application 内部的取更新循环（_update_fetcher）并使用内部的 _STOP_SIGNAL，
+# 依赖 python-telegram-bot 20.0 的实现（requirements.txt 固定了该版本）；升级前需对照新版本的 _update_fetcher 修改
+if telegram.__version_info__[:2] != (20, 0):
+    raise ImportError(f"bot.updates 依赖 python-telegram-bot 20.0 的内部实现，当前为 {telegram.__version__}")
+from telegram.ext._application import _STOP_SIGNAL
+
+# 同时执行的处理函数数上限（不同用户/聊天之间并发）
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+# update_queue 容量：队列满时 webhook 请求、多进程的分发连接、长轮询都会等待，不再接收新更新
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "10000"))
+# 已从 update_queue 取出、尚未处理完的更新数上限（包括在等待同一聊天前序更新或并发名额的），
+# 达到后暂停取更新，其余更新留在 update_queue 中
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1024"))
+# 单个聊天最多占用的待处理名额：超出的更新暂存在该聊天自己的队列中，不占名额，
+# 某个聊天刷屏且处理缓慢时不会占满 UPDATE_MAX_PENDING 而阻塞其他聊天。暂存的更新总数上限同 UPDATE_QUEUE_SIZE
+UPDATE_MAX_PENDING_PER_CHAT = int(os.getenv("UPDATE_MAX_PENDING_PER_CHAT", "16"))
+
+class _KeyLock:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+class _KeyBacklog:
+    """同一顺序分组中已取出的更新：admitted 为占用待处理名额的更新数，deferred 为超出单个聊天上限而暂存的更新"""
+
+    def __init__(self):
+        self.admitted = 0
+        self.deferred = deque()
+
+class OrderedApplication(Application):
+    """
+    并发处理更新，但同一聊天（没有聊天时按用户）的更新严格按到达顺序逐个处理。
+    需配合 concurrent_updates 使用：按到达顺序为每个更新创建任务，
+    每个任务先排队等待同一聊天的前序更新，再占用全局并发名额执行处理函数。
+    已取出未处理完的更新数达到 UPDATE_MAX_PENDING 时暂停从 update_queue 取更新；
+    单个聊天最多占用 UPDATE_MAX_PENDING_PER_CHAT 个名额，其余更新暂存，等该聊天的前序更新处理完再接着处理。
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._key_locks = {}
+        self._slots = asyncio.Semaphore(UPDATE_CONCURRENCY)
+        self._pending_slots = asyncio.Semaphore(UPDATE_MAX_PENDING)
+        self._backlogs = {}  # {顺序分组: _KeyBacklog}
+        self._deferred_space = asyncio.Event()
+        self._deferred_space.set()
+        self.deferred_updates = 0
+        self.pending_updates = 0
+        self.running_updates = 0
+        self.processed_updates = 0
+        self.max_pending_updates = 0
+
+    async def _update_fetcher(self):
+        """
+        替换 Application 的取更新循环：原实现为每个更新立即创建任务，在任务内等待并发名额，
+        待处理的更新数不受限制，也不在 update_queue 中体现。
+        这里先占用一个待处理名额再取更新，名额用完时更新留在队列中；
+        同一聊天占用的名额达到上限时，更新暂存到该聊天的队列并归还名额
+        """
+        while True:
+            if self.deferred_updates >= UPDATE_QUEUE_SIZE:
+                self._deferred_space.clear()
+                await self._deferred_space.wait()
+            await self._pending_slots.acquire()
+            update = await self.update_queue.get()
+            if update is _STOP_SIGNAL:
+                self._pending_slots.release()
+                while not self.update_queue.empty():
+                    self.update_queue.task_done()
+                self.update_queue.task_done()
+                return
+            key = update_order_key(update)
+            if key is not None:
+                backlog = self._backlogs.get(key)
+                if backlog is None:
+                    backlog = self._backlogs[key] = _KeyBacklog()
+                if backlog.admitted >= UPDATE_MAX_PENDING_PER_CHAT:
+                    backlog.deferred.append(update)
+                    self.deferred_updates += 1
+                    self._pending_slots.release()
+                    continue
+                backlog.admitted += 1
+            if self._concurrent_updates:
+                self.create_task(self._process_fetched(update, key), update=update)
+            else:
+                await self._process_fetched(update, key)
+
+    async def _process_fetched(self, update, key):
+        """处理一个更新；该聊天有暂存的更新时，名额直接交给下一个，在同一任务中接着处理"""
+        try:
+            while True:
+                try:
+                    await self.process_update(update)
+                finally:
+                    self.update_queue.task_done()
+                backlog = self._backlogs.get(key) if key is not None else None
+                if backlog is None or not backlog.deferred:
+                    break
+                update = backlog.deferred.popleft()
+                self.deferred_updates -= 1
+                self._deferred_space.set()
+        finally:
+            if key is not None:
+                backlog = self._backlogs[key]
+                backlog.admitted -= 1
+                if not backlog.admitted and not backlog.deferred:
+                    del self._backlogs[key]
+            self._pending_slots.release()
+
+    async def process_update(self, update):
+        self.pending_updates += 1
+        self.max_pending_updates = max(self.max_pending_updates, self.pending_updates)
+        try:
+            key = update_order_key(update)
+            if key is None:
+                return await self._process(update)
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = self._key_locks[key] = _KeyLock()
+            entry.users += 1
+            try:
+                async with entry.lock:
+                    return await self._process(update)
+            finally:
+                entry.users -= 1
+                if not entry.users:
+                    del self._key_locks[key]
+        finally:
+            self.pending_updates -= 1
+
+    async def _process(self, update):
+        async with self._slots:
+            self.running_updates += 1
+            try:
+                return await super().process_update(update)
+            finally:
+                self.running_updates -= 1
+                self.processed_updates += 1
+
+    def update_stats(self):
+        """
+        更新处理情况：queued 为 update_queue 中尚未取出的更新（待处理数达到上限后新到的更新留在这里），
+        waiting 为已取出、在等待同一聊天前序更新（含超出单个聊天上限而暂存的）或并发名额的更新
+        """
+        return {
+            "queued": self.update_queue.qsize(),
+            "waiting": self.pending_updates - self.running_updates + self.deferred_updates,
+            "deferred": self.deferred_updates,
+            "running": self.running_updates,
+            "processed": self.processed_updates,
+            "max_pending": self.max_pending_updates,
+            "pending_limit": UPDATE_MAX_PENDING,
+            "pending_limit_per_chat": UPDATE_MAX_PENDING_PER_CHAT,
+            "concurrency": UPDATE_CONCURRENCY,
+        }
+
+def update_order_key(update):
+    """决定更新的顺序分组：同一聊天的更新串行，没有聊天时按用户；都没有时不限制顺序"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return ("chat", update.effective_chat.id)
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    return None
@@ -0,0 +1,210 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+from urllib.parse import urlsplit
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Telegram 推送更新的公网地址（https），为空时不调用 setWebhook（用于本地测试）
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# 本地监听地址和端口，一般放在 nginx 等反向代理之后
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# 接收更新的路径，默认取 WEBHOOK_URL 中的路径
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or urlsplit(WEBHOOK_URL).path or "/webhook"
+# 校验请求头 X-Telegram-Bot-Api-Secret-Token，为空时不校验
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# setWebhook 的 max_connections：Telegram 同时推送的请求数上限。
+# update_queue 已满（见 bot/updates.py 的 UPDATE_QUEUE_SIZE）时请求等到有空位才响应，Telegram 随之暂停推送
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# 停机时等待进行中请求完成的最长时间（秒）
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))
+
+# 单个请求体上限（字节）、keep-alive 连接空闲超时（秒）
+MAX_BODY_SIZE = 1024 * 1024
+IDLE_TIMEOUT = 75
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+class WebhookServer:
+    """
+    最小的 HTTP/1.1 接收端：只接受 POST 到 path 的 JSON 更新，校验密钥后放入 application.update_queue，
+    由 Application 正常分发处理。队列已满时等到有空位再响应。
+    支持 keep-alive；stop() 先停止监听，再等待进行中的请求完成。
+    """
+
+    def __init__(self, application, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self._server = None
+        self._connections = {}  # {task: 是否正在处理请求}
+        self._closing = False
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Webhook 已监听 http://%s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """停止接收新请求：关闭空闲连接，等待处理中的请求完成（超时后强制关闭）"""
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+        for task, busy in list(self._connections.items()):
+            if not busy:
+                task.cancel()
+        tasks = list(self._connections)
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = False
+        try:
+            while not self._closing:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                    break
+                self._connections[task] = True
+                keep_alive = await self._handle_request(head, reader, writer)
+                self._connections[task] = False
+                if not keep_alive:
+                    break
+        except (asyncio.CancelledError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.exception("Webhook 连接处理出错: %s", e)
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _handle_request(self, head, reader, writer):
+        """处理一个请求并写回响应，返回是否保持连接"""
+        try:
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, target, version = request_line.split(" ", 2)
+        except ValueError:
+            await self._respond(writer, 400, False)
+            return False
+        headers = {}
+        for line in header_lines:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+        length = headers.get("content-length")
+        if length is not None:
+            try:
+                length = int(length)
+            except ValueError:
+                length = -1
+            if length < 0:
+                # 无法解析或为负数：请求体长度未知，响应后关闭连接
+                await self._respond(writer, 400, False)
+                return False
+        if length is None and "transfer-encoding" in headers:
+            # 不读取 chunked 请求体，连接上剩余的数据无法作为下一个请求解析，响应后关闭
+            keep_alive = False
+        if length is not None and length > MAX_BODY_SIZE:
+            await self._respond(writer, 413, False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        if urlsplit(target).path != self.path:
+            status = 404
+        elif method != "POST":
+            status = 405
+        elif length is None:
+            status, keep_alive = 411, False
+        elif self.secret and not hmac.compare_digest(
+                headers.get("x-telegram-bot-api-secret-token", "").encode(), self.secret.encode()):
+            status = 403
+        else:
+            status = await self._enqueue(body)
+        await self._respond(writer, status, keep_alive and not self._closing)
+        return keep_alive
+
+    async def _enqueue(self, body):
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            logger.warning("Webhook 收到无法解析的更新: %s", e)
+            return 400
+        if update is None:
+            return 400
+        await self.application.update_queue.put(update)
+        return 200
+
+    async def _respond(self, writer, status, keep_alive):
+        body = REASONS.get(status, "").encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+async def wait_for_stop_signal():
+    """等待 SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    await stop_event.wait()
+
+async def register_webhook(bot):
+    await bot.set_webhook(
+        url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET or None,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    logger.info("已设置 webhook: %s", WEBHOOK_URL)
+
+async def serve(application, server, on_started=None):
+    """
+    不使用 Updater，由 server 把更新放入 application.update_queue。
+    收到 SIGINT/SIGTERM 后依次停止接收、处理完已收到的更新、停机
+    """
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        if on_started:
+            await on_started()
+        await wait_for_stop_signal()
+    finally:
+        logger.info("正在停止接收更新，等待进行中的请求完成...")
+        await server.stop()
+        # Application.stop 会先处理完队列中已收到的更新
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+async def serve_webhook(application):
+    """以 webhook 方式运行 Application"""
+    async def on_started():
+        if WEBHOOK_URL:
+            await register_webhook(application.bot)
+    await serve(application, WebhookServer(application), on_started)
+
+def run_webhook(application):
+    asyncio.run(serve_webhook(application))